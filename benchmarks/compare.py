@@ -0,0 +1,51 @@
+"""
+Compares two benchmark result files written by benchmarks.run.
+
+Usage (from the repository root):
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.1]
+
+Prints throughput and p99 latency per stage and size, and exits with status 1 when any
+stage's throughput dropped or its p99 latency grew by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {
+        (result["stage"], result["size"], result.get("cache")): result
+        for result in report["results"]
+    }
+
+def ratio(new, old):
+    return new / old if old else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    regressions = 0
+    print(f"{'stage':<36}{'size':>8}{'items/s old':>14}{'items/s new':>14}{'p99 ms old':>12}{'p99 ms new':>12}")
+    for key in sorted(baseline.keys() & candidate.keys(), key=lambda key: (key[0], key[1], key[2] or "")):
+        old, new = baseline[key], candidate[key]
+        stage = key[0] + (f" ({key[2]})" if key[2] else "")
+        throughput = ratio(new["items_per_sec"] or 0, old["items_per_sec"] or 0)
+        latency = ratio(new["p99_ms"], old["p99_ms"])
+        regressed = (throughput is not None and throughput < 1 - args.threshold) or \
+            (latency is not None and latency > 1 + args.threshold)
+        regressions += regressed
+        print(f"{stage:<36}{key[1]:>8}{old['items_per_sec'] or 0:>14.1f}{new['items_per_sec'] or 0:>14.1f}"
+              f"{old['p99_ms']:>12.2f}{new['p99_ms']:>12.2f}{'  REGRESSED' if regressed else ''}")
+    if regressions:
+        print(f"{regressions} stage(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
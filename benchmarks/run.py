@@ -0,0 +1,310 @@
+"""
+End-to-end benchmarks of the classification and training pipelines.
+
+Usage (from the repository root):
+    python -m benchmarks.run [--sizes 1000,10000,100000] [--mongo local|mock] [--output results.json]
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+For every size, that many labelled tickets are stored and the stages below are timed:
+    similarity_index_refresh   indexing the stored tickets
+    train_model                training a fresh model on every stored ticket
+    get_most_similar_tickets   one query ticket at a time
+    generate_embedding         one text at a time, uncached (cold) and cached (warm)
+    classify_tickets           chunks of new tickets, embedding to saved documents
+    cluster_tickets            clustering up to --cluster-max tickets with warm embeddings
+
+Stored tickets get vectors scattered around the embeddings of a small pool of synthetic
+tickets, so seeding 100k tickets doesn't require encoding 100k texts.
+
+--mongo local (default) uses MONGO_URI with a separate database that is dropped before and
+after the run. --mongo mock runs against mongomock instead (pip install -r
+benchmarks/requirements.txt); it needs no server but is slower than mongod and doesn't
+support every query, so its numbers are only comparable with other mock runs. train_model is
+skipped under mock, so classify_tickets needs KNN_FAST_PATH=true there to label anything.
+classify_tickets fails when it classifies no tickets, rather than timing a pipeline that only
+produced errors.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+import numpy as np
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+# Stages that can't run against mongomock, with the reason
+MOCK_UNSUPPORTED_STAGES = {
+    "train_model": "mongomock can't evaluate the $expr query that selects edited tickets for training",
+}
+
+def configure_environment(args, work_dir):
+    """Points the application at throwaway storage. Must run before any application import."""
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["SIMILARITY_INDEX_DIR"] = os.path.join(work_dir, "similarity_index")
+    os.environ["MODEL_STORE_DIR"] = os.path.join(work_dir, "model_versions")
+    os.environ["UPLOAD_DIR"] = os.path.join(work_dir, "uploads")
+    if args.mongo == "mock":
+        import mongomock
+        import mongomock_motor
+        import motor.motor_asyncio
+        import pymongo
+        # The async client shares the sync client's store, as with a real server
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: client
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: mongomock_motor.AsyncMongoMockClient(
+            mock_mongo_client=client
+        )
+
+def summarize(stage, size, latencies, items, **extra):
+    """One result row: throughput over all runs, and latency percentiles per run."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    seconds = float(latencies.sum())
+    return {
+        "stage": stage,
+        "size": size,
+        "runs": len(latencies),
+        "items": items,
+        "seconds": round(seconds, 4),
+        "items_per_sec": round(items / seconds, 2) if seconds else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        **extra
+    }
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark:
+    def __init__(self, args, logger):
+        # Application modules are imported only after configure_environment
+        from pymongo import InsertOne
+        from benchmarks.synthetic import generate_tickets, jitter_vectors
+        from utils import connection
+        from utils.bulk_writer import BulkWriter
+        from utils.embeddings import generate_embedding, generate_embeddings
+        from utils.vector_codec import encode_vector
+        from utils.clustering import cluster_tickets, ticket_text
+        from services.similarity_index import similarity_index
+        from services.similar_ticket import get_most_similar_tickets
+        from services.ticket_classification import classify_ticket_chunk
+        from services.model_training import train_model
+        from services.model_store import model_store
+        from services.model_registry import model_registry
+
+        self.args = args
+        self.logger = logger
+        self.InsertOne = InsertOne
+        self.generate_tickets = generate_tickets
+        self.jitter_vectors = jitter_vectors
+        self.connection = connection
+        self.BulkWriter = BulkWriter
+        self.generate_embedding = generate_embedding
+        self.generate_embeddings = generate_embeddings
+        self.encode_vector = encode_vector
+        self.cluster_tickets = cluster_tickets
+        self.ticket_text = ticket_text
+        self.similarity_index = similarity_index
+        self.get_most_similar_tickets = get_most_similar_tickets
+        self.classify_ticket_chunk = classify_ticket_chunk
+        self.train_model = train_model
+        self.model_store = model_store
+        self.model_registry = model_registry
+        self.stored = 0
+        self.results = []
+        # One loop for the whole run, since the motor client binds to the loop it first runs on
+        self.loop = asyncio.new_event_loop()
+
+    def drop_database(self):
+        self.connection.get_client().drop_database(self.args.db_name)
+        self.connection.collection_handles.clear()
+
+    def prepare_pool(self):
+        """Embeds the pool of synthetic tickets that stored ticket vectors are scattered around."""
+        pool = self.generate_tickets(self.args.pool_size, seed=1)
+        self.pool_categories = np.array([ticket["category"] for ticket in pool])
+        self.logger.info(f"Embedding {len(pool)} pool tickets")
+        self.pool_vectors = self.generate_embeddings([self.ticket_text(ticket) for ticket in pool], as_numpy=True)
+
+    def seed(self, size):
+        """Stores labelled tickets until `size` are stored."""
+        count = size - self.stored
+        if count <= 0:
+            return
+        vectors, rows = self.jitter_vectors(self.pool_vectors, count, seed=size)
+        categories = self.pool_categories[rows]
+        now = datetime.now(timezone.utc).isoformat()
+        with self.BulkWriter(self.connection.get_mongo_collection("classified_tickets")) as writer:
+            for i, (vector, category) in enumerate(zip(vectors, categories)):
+                writer.add(self.InsertOne({
+                    "ticket_id": self.stored + i,
+                    "ticket_description": "synthetic",
+                    "product": "benchmark",
+                    "created_date": now,
+                    "classification_category": str(category),
+                    "confidence_score": 0.9,
+                    "mode_of_tagging": "chatgpt",
+                    "vectorized_data": self.encode_vector(vector),
+                    "createdAt": now,
+                    "updatedAt": now
+                }))
+        self.stored = size
+
+    def bench_refresh(self, size):
+        seconds, added = timed(self.similarity_index.refresh, self.logger)
+        self.results.append(summarize("similarity_index_refresh", size, [seconds], added))
+
+    def bench_train(self, size):
+        # Train from scratch on every stored ticket rather than on the tickets added since the last size
+        shutil.rmtree(self.model_store.store_dir, ignore_errors=True)
+        self.model_registry.reload()
+        seconds, details = timed(self.train_model, self.logger)
+        self.results.append(summarize("train_model", size, [seconds], details["num_tickets"] if details else 0))
+
+    def bench_similarity(self, size):
+        queries = self.jitter_vectors(self.pool_vectors, self.args.queries, seed=size + 1)[0]
+        latencies = [timed(self.get_most_similar_tickets, query[None, :])[0] for query in queries]
+        self.results.append(summarize("get_most_similar_tickets", size, latencies, len(queries)))
+
+    def bench_embedding(self, size):
+        texts = [self.ticket_text(ticket) for ticket in self.generate_tickets(self.args.queries, seed=size + 2)]
+        # Unique suffixes keep the cold pass from hitting the cache
+        texts = [f"{text} #{size}-{i}" for i, text in enumerate(texts)]
+        cold = [timed(self.generate_embedding, text)[0] for text in texts]
+        warm = [timed(self.generate_embedding, text)[0] for text in texts]
+        self.results.append(summarize("generate_embedding", size, cold, len(texts), cache="cold"))
+        self.results.append(summarize("generate_embedding", size, warm, len(texts), cache="warm"))
+
+    def bench_classify(self, size):
+        tickets = self.generate_tickets(self.args.classify_tickets, seed=size + 3, start_id=10_000_000)
+        job_id = f"benchmark-{uuid4()}"
+        # The job document collects the chunks' fast path stats
+        self.connection.get_mongo_collection("jobs").insert_one({"job_id": job_id, "Status": "IN_PROGRESS"})
+        chunk_size = self.args.chunk_size
+        latencies = []
+        classified = 0
+        try:
+            for start in range(0, len(tickets), chunk_size):
+                chunk = tickets[start:start + chunk_size]
+                seconds, saved = timed(self.loop.run_until_complete, self.classify_ticket_chunk(job_id, chunk, self.logger))
+                latencies.append(seconds)
+                classified += len(saved)
+            job = self.connection.get_mongo_collection("jobs").find_one({"job_id": job_id}) or {}
+        finally:
+            # Keep classified tickets out of the next size's index and training data
+            self.connection.get_mongo_collection("tickets").delete_many({"job_id": job_id})
+            self.connection.get_mongo_collection("jobs").delete_one({"job_id": job_id})
+        if not classified:
+            raise RuntimeError(
+                "classify_tickets classified none of its tickets; it needs a trained model (the "
+                "train_model stage) or the kNN fast path (KNN_FAST_PATH=true)"
+            )
+        self.results.append(summarize(
+            "classify_tickets", size, latencies, len(tickets), classified=classified,
+            chunk_size=chunk_size, classification_stats=job.get("classification_stats")
+        ))
+
+    def bench_cluster(self, size):
+        tickets = self.generate_tickets(min(size, self.args.cluster_max), seed=size + 4)
+        # Embeddings are cached first so the stage measures clustering, not encoding
+        self.generate_embeddings([self.ticket_text(ticket) for ticket in tickets])
+        seconds, _ = timed(self.loop.run_until_complete, self.cluster_tickets(tickets, self.logger))
+        self.results.append(summarize("cluster_tickets", size, [seconds], len(tickets)))
+
+    def run(self):
+        self.drop_database()
+        self.prepare_pool()
+        stages = [
+            ("similarity_index_refresh", self.bench_refresh),
+            ("train_model", self.bench_train),
+            ("get_most_similar_tickets", self.bench_similarity),
+            ("generate_embedding", self.bench_embedding),
+            ("classify_tickets", self.bench_classify),
+            ("cluster_tickets", self.bench_cluster),
+        ]
+        try:
+            for size in sorted(self.args.sizes):
+                self.logger.info(f"Seeding {size} stored tickets")
+                self.seed(size)
+                for name, bench in stages:
+                    if self.args.stages and name not in self.args.stages:
+                        continue
+                    if self.args.mongo == "mock" and name in MOCK_UNSUPPORTED_STAGES:
+                        self.logger.warning(f"Skipping {name} under --mongo mock: {MOCK_UNSUPPORTED_STAGES[name]}")
+                        continue
+                    self.logger.info(f"Benchmarking {name} with {size} stored tickets")
+                    bench(size)
+                    print(json.dumps(self.results[-1]))
+        finally:
+            self.loop.close()
+            if not self.args.keep:
+                self.drop_database()
+        return self.results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated numbers of stored tickets")
+    parser.add_argument("--stages", default="", help="comma-separated stages to run (default: all)")
+    parser.add_argument("--mongo", choices=["local", "mock"], default="local")
+    parser.add_argument("--db-name", default="ticket_classification_benchmark")
+    parser.add_argument("--queries", type=int, default=200, help="single-ticket calls per latency stage")
+    parser.add_argument("--classify-tickets", type=int, default=2000, help="tickets classified per size")
+    parser.add_argument("--chunk-size", type=int, default=500, help="tickets per classify_tickets chunk")
+    parser.add_argument("--cluster-max", type=int, default=10000, help="most tickets clustered per size")
+    parser.add_argument("--pool-size", type=int, default=2000, help="synthetic tickets embedded to seed vectors")
+    parser.add_argument("--output", help=f"results file (default: {RESULTS_DIR}/<timestamp>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+    args.stages = [stage for stage in args.stages.split(",") if stage]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.LoggerAdapter(logging.getLogger("benchmark"), {"request_id": "benchmark"})
+    started_at = datetime.now(timezone.utc)
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        configure_environment(args, work_dir)
+        results = Benchmark(args, logger).run()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "started_at": started_at.isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "mongo": args.mongo,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "results": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, started_at.strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {output}")
+
+if __name__ == "__main__":
+    main()
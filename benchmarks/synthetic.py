@@ -0,0 +1,68 @@
+"""
+Synthetic support tickets for benchmarks, generated from the feature categories in metadata.json.
+
+Each ticket mixes words of one feature's description with filler phrases and typos, so
+tickets of the same category are similar without being identical.
+"""
+import json
+import random
+import re
+from datetime import date, timedelta
+import numpy as np
+
+METADATA_PATH = "metadata.json"
+PRODUCTS = ["Gen TDS", "Gen GST", "Gen Payroll", "Gen Income Tax", "Gen CompuTax"]
+OPENERS = [
+    "Unable to", "Getting error while trying to", "Customer is not able to", "Need help to",
+    "Issue when trying to", "Facing problem to", "Please check, cannot"
+]
+CLOSERS = [
+    "", "urgent", "since yesterday", "after latest update", "for all deductors", "on client machine",
+    "showing error message", "please call back"
+]
+WORD = re.compile(r"[A-Za-z0-9]{3,}")
+
+def load_features(metadata_path=METADATA_PATH):
+    """Returns (feature name, description words) for every feature in metadata.json."""
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    return [
+        (feature["feature_name"], WORD.findall(feature["description_metadata"]))
+        for feature in metadata
+    ]
+
+def _typo(word, rng):
+    if len(word) < 5 or rng.random() > 0.1:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def generate_tickets(count, seed=0, start_id=1, metadata_path=METADATA_PATH):
+    """Returns `count` tickets in the upload format, each with its intended `category`."""
+    rng = random.Random(seed)
+    features = load_features(metadata_path)
+    first_date = date(2024, 1, 1)
+    tickets = []
+    for i in range(count):
+        category, words = features[rng.randrange(len(features))]
+        body = " ".join(_typo(word, rng) for word in rng.sample(words, min(len(words), rng.randint(4, 9))))
+        description = f"{rng.choice(OPENERS)} {body} {rng.choice(CLOSERS)}".strip()
+        tickets.append({
+            "ticket_id": start_id + i,
+            "description": description,
+            "product": rng.choice(PRODUCTS),
+            "created_date": (first_date + timedelta(days=rng.randrange(365))).isoformat(),
+            "category": category
+        })
+    return tickets
+
+def jitter_vectors(base_vectors, count, seed=0, noise=0.05):
+    """
+    Returns `count` unit vectors scattered around rows of `base_vectors`, and the base row of each.
+    Lets benchmarks store 100k labelled tickets without encoding 100k texts.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(base_vectors), size=count)
+    vectors = base_vectors[rows] + rng.normal(0, noise, size=(count, base_vectors.shape[1])).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32), rows
@@ -0,0 +1,25 @@
+"""
+Serves the API with several uvicorn workers that share one copy of the model weights.
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+
+The app and its models are loaded in the master process before the workers fork, so the
+transformer and classifier weights are shared copy-on-write instead of loaded per worker.
+Classification jobs embed and classify tickets in threads of each worker with these shared
+models, so no other process loads them.
+Nothing is run or connected before the fork: Mongo clients and the job scheduler start in
+each worker, and each worker still warms up and reports it on /ready.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Loading the models takes longer than gunicorn's default 30s on cold nodes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = True
+
+def on_starting(server):
+    from services.warm_up import preload_models
+    preload_models()
@@ -1,10 +1,27 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+import time
 import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from fastapi import Request
 
 # Define the logging format
 LOG_FORMAT = "%(asctime)s - %(levelname)s - [%(request_id)s] - %(message)s"
 
+# DEBUG while developing, INFO in production
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+# "text" for LOG_FORMAT lines, "json" for one JSON object per line
+LOG_OUTPUT_FORMAT = os.getenv("LOG_OUTPUT_FORMAT", "text").lower()
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_FILE_BACKUP_COUNT = int(os.getenv("LOG_FILE_BACKUP_COUNT", "5"))
+# Debug records kept per call site and second; the rest are dropped and counted
+LOG_DEBUG_RATE_LIMIT = int(os.getenv("LOG_DEBUG_RATE_LIMIT", "10"))
+
 # Custom filter to ensure `request_id` is always present
 class RequestIdFilter(logging.Filter):
     def filter(self, record):
@@ -12,29 +29,97 @@ class RequestIdFilter(logging.Filter):
             record.request_id = "N/A"  # Default value if missing
         return True
 
+class DebugRateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` DEBUG records per second from each call site, so debug
+    logging inside per-ticket loops can't flood the logs. The next record let through from
+    a call site reports how many were dropped.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        second = int(time.monotonic())
+        with self.lock:
+            window_second, count, dropped = self.windows.get(site, (second, 0, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            if count >= self.rate:
+                self.windows[site] = (window_second, count, dropped + 1)
+                return False
+            self.windows[site] = (window_second, count + 1, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar debug messages dropped)"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with `request_id` and `job_id` when known."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "N/A"),
+            "message": record.getMessage()
+        }
+        job_id = getattr(record, "job_id", None)
+        if job_id:
+            entry["job_id"] = job_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
 # Create a logger
 logger = logging.getLogger("app_logger")
-logger.setLevel(logging.DEBUG)  # Set to INFO in production
+logger.setLevel(LOG_LEVEL)
 
 # Create a console handler
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
 
-# Create a file handler
-file_handler = logging.FileHandler("app.log", mode="a")
-file_handler.setLevel(logging.DEBUG)
+# Create a file handler, rotated so app.log can't fill the disk. Give each process its own
+# LOG_FILE when running several workers, as rotation isn't coordinated between processes.
+file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT)
 
 # Create a formatter and set it for both handlers
-formatter = logging.Formatter(LOG_FORMAT)
+formatter = JsonFormatter() if LOG_OUTPUT_FORMAT == "json" else logging.Formatter(LOG_FORMAT)
 console_handler.setFormatter(formatter)
 file_handler.setFormatter(formatter)
 
+# The logger only enqueues records; a listener thread does the console and file I/O,
+# so logging never blocks the event loop
+queue_handler = QueueHandler(queue.SimpleQueue())
+queue_listener = None
+
+def start_log_listener():
+    """Starts the listener thread. Forked processes (e.g. preloaded gunicorn workers) don't inherit it, so each starts its own."""
+    global queue_listener
+    queue_handler.queue = queue.SimpleQueue()
+    queue_listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    queue_listener.start()
+
+def stop_log_listener():
+    """Writes the records still queued and stops the listener thread."""
+    if queue_listener is not None:
+        queue_listener.stop()
+
+start_log_listener()
+atexit.register(stop_log_listener)
+os.register_at_fork(after_in_child=start_log_listener)
+
 # Attach handlers to the logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+logger.addHandler(queue_handler)
 
-# Attach the custom request_id filter
+# Attach the custom request_id filter and drop debug floods before they are queued
 logger.addFilter(RequestIdFilter())
+logger.addFilter(DebugRateLimitFilter(LOG_DEBUG_RATE_LIMIT))
 
 # Middleware to attach `request_id` to every request
 async def request_id_middleware(request: Request, call_next):
@@ -46,3 +131,8 @@ async def request_id_middleware(request: Request, call_next):
 def get_logger(request: Request):
     request_id = getattr(request.state, "request_id", "N/A")
     return logging.LoggerAdapter(logger, {"request_id": request_id})
+
+def get_job_logger(job_logger, job_id):
+    """Returns `job_logger` with `job_id` added to every record it logs."""
+    extra = dict(getattr(job_logger, "extra", None) or {}, job_id=job_id)
+    return logging.LoggerAdapter(getattr(job_logger, "logger", job_logger), extra)
@@ -1,19 +1,29 @@
-from fastapi import FastAPI, UploadFile, File, Request, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from services.ticket_classification import classify_tickets
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from services.job_scheduler import job_scheduler, JobQueueFull
+from services.job_events import job_event_bus, watch_job_changes, JOB_EVENTS_BACKEND, JOB_EVENTS_POLL_INTERVAL, RESYNC_EVENT
 from services.train_with_chatgpt import train_with_chatgpt
-from services.model_training import train_model
+from services.training_jobs import training_job_runner, TrainingJobActive
+from services.model_store import model_store
+from services.model_registry import model_registry
+from services.warm_up import warm_up, warm_up_state
+from utils.embeddings import embedding_batcher
+from utils.embedding_batcher import EMBEDDING_MICROBATCH
 import utils.connection as connection
 import asyncio
-from services.database import createClassificationJob, checkClassificationTaskStatus, getClassificationResults, updateCategoryClassification
-import json
+from services.database import createClassificationJob, checkClassificationTaskStatus, iterClassificationResults, updateCategoryClassification, updateJobStatus
 from typing import List
 from pydantic import BaseModel
-from utils.validateFile import isValidJSONFile, isAllColumnsPresent, isEmptyFile
+from utils.validateFile import isValidJSONFile, isValidNDJSONFile, isStreamContentType
+from utils.ticket_stream import spool_upload, iter_upload_chunks, scan_upload, TicketStreamError
 from logging_config import request_id_middleware, get_logger
 import logging
 import uuid
+import os
+from bson import ObjectId
+from utils.serialization import dumps, encode_cursor, decode_cursor
+from utils.metrics import render_metrics, JOB_QUEUE_DEPTH, RUNNING_JOBS
 
 origins = [
     "http://localhost:3000",  # Allow frontend during development
@@ -39,12 +49,49 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    startup_logger = logging.getLogger("app_logger")
+    await asyncio.to_thread(connection.ensure_indexes, startup_logger)
+    await asyncio.to_thread(connection.find_collection_scans, startup_logger)
+
+
+@app.on_event("startup")
+async def start_job_scheduler():
+    # Also reclaims jobs left in progress by a previous process
+    await job_scheduler.start(logging.getLogger("app_logger"))
+
+
+@app.on_event("startup")
+async def start_embedding_batcher():
+    if EMBEDDING_MICROBATCH:
+        await embedding_batcher.start()
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Runs in the background so the server answers health checks meanwhile; /ready reports when it's done
+    app.state.warm_up = asyncio.create_task(asyncio.to_thread(warm_up, logging.getLogger("app_logger")))
+
+
+@app.on_event("shutdown")
+async def stop_job_scheduler():
+    await job_scheduler.stop()
+    training_job_runner.stop()
+    await embedding_batcher.stop()
+
+
 @app.get("/")
 async def root(request:Request):
     logger = get_logger(request)
     logger.info("Request to Index Server Received")
     return {"message": "Server is running!"}
 
+@app.get("/ready")
+async def ready():
+    state = warm_up_state.snapshot()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
 @app.get("/test-cors")
 async def test_cors():
     return {"message": "CORS is working!"}
@@ -58,99 +105,228 @@ class Ticket(BaseModel):
 class TicketRequest(BaseModel):
     tickets: List[Ticket]
 
+async def start_classification(upload_path, logger):
+    """Validates a spooled upload and schedules its classification job."""
+    try:
+        ticket_count, invalid_position = await asyncio.to_thread(scan_upload, upload_path)
+    except TicketStreamError as e:
+        os.remove(upload_path)
+        logger.error("Malformed ticket upload received")
+        return JSONResponse(status_code=400, content={"message":str(e), "job_id":""})
+
+    if ticket_count == 0 and invalid_position is None:
+        os.remove(upload_path)
+        logger.warning("Empty JSON file received for classification")
+        return JSONResponse(
+            status_code=400, content={"message":"Uploaded file is empty", "job_id":""}
+        )
+    if invalid_position is not None:
+        os.remove(upload_path)
+        logger.warning("Missing columns in JSON file required for classification")
+        return JSONResponse(
+            status_code=400,
+            content={"message":f"uploaded file missing description and product column (ticket {invalid_position + 1})", "job_id":""}
+        )
+    if job_scheduler.is_full():
+        os.remove(upload_path)
+        logger.warning("Classification queue is full, rejecting upload")
+        return JSONResponse(
+            status_code=429, content={"message":"Too many classification jobs queued, please retry later", "job_id":""}
+        )
+    job_id = await createClassificationJob(logger, {
+        **job_scheduler.job_fields(),
+        "upload_path":upload_path,
+        "progress":{"processed":0, "total":ticket_count}
+    })
+    if job_id:
+        try:
+            job_scheduler.submit(job_id, upload_path, logger, ticket_count)
+        except JobQueueFull as e:
+            os.remove(upload_path)
+            await updateJobStatus(job_id, "FAILED")
+            return JSONResponse(status_code=429, content={"message":str(e), "job_id":""})
+        logger.info(f"Queued {ticket_count} tickets for classification")
+        return JSONResponse(
+            status_code=200,
+            content={"message":"Ticket Classification Started", "job_id":job_id}
+        )
+    else:
+        os.remove(upload_path)
+        raise HTTPException(status_code=500, detail="Internal Server")
+
 @app.post("/classify_tickets")
-async def classify(request:Request, background_tasks: BackgroundTasks, file:UploadFile = File(...)):
+async def classify(request:Request, file:UploadFile = File(...)):
     logger = get_logger(request)
-    if isValidJSONFile(file)==False:
+    if isValidJSONFile(file)==False and isValidNDJSONFile(file)==False:
         logger.error("Invalid JSON File Format Received")
         return JSONResponse(
-            status_code=400, content={"message":"Invalid file format. Please upload a JSON file.", job_id:""}
+            status_code=400, content={"message":"Invalid file format. Please upload a JSON or NDJSON file.", "job_id":""}
         )
     try:
-        # Read file content
-        file_content = await file.read()
-        
-        # Parse JSON data
-        data = json.loads(file_content)
-        
-        # Extract tickets from JSON
-        tickets = data.get("tickets", [])
-        
-
-        if isEmptyFile(tickets)==True:
-            logger.warning("Empty JSON file received for classification")
-            return JSONResponse(
-            status_code=400, content={"message":"Uploaded file is empty", job_id:""}
+        # Spool the upload to disk in chunks; tickets are parsed incrementally from there
+        upload_path = await spool_upload(iter_upload_chunks(file))
+        return await start_classification(upload_path, logger)
+
+    except Exception as e:
+        logger.error("Exception occured while processing request")
+        return JSONResponse(
+            status_code=400, content={"message":str(e), "job_id":""}
+        )
+
+@app.post("/classify_tickets/stream")
+async def classify_stream(request:Request):
+    """Classifies tickets sent as the raw request body, either `{"tickets": [...]}` JSON or NDJSON."""
+    logger = get_logger(request)
+    if isStreamContentType(request.headers.get("content-type", ""))==False:
+        logger.error("Invalid content type received for streaming classification")
+        return JSONResponse(
+            status_code=400, content={"message":"Content-Type must be application/json or application/x-ndjson", "job_id":""}
         )
-        if isAllColumnsPresent(tickets)==False:
-            logger.warning("Missing columns in JSON file required for classification")
-            return JSONResponse(
-                status_code=400, content={"message":"uploaded file missing description and product column", job_id:""}
-            )
-        job_id = await createClassificationJob(logger)
-        if job_id:
-            background_tasks.add_task(classify_tickets, job_id, tickets, logger)
-            return JSONResponse(
-                status_code=200,
-                content={"message":"Ticket Classification Started", "job_id":job_id}
-            )
-        else:
-            raise HTTPException(status_code=500, detail="Internal Server")
-
-        
+    try:
+        upload_path = await spool_upload(request.stream())
+        return await start_classification(upload_path, logger)
+
     except Exception as e:
         logger.error("Exception occured while processing request")
         return JSONResponse(
             status_code=400, content={"message":str(e), "job_id":""}
         )
     
+# Tickets per websocket message when sending results read from Mongo
+WEBSOCKET_PAGE_SIZE = int(os.getenv("WEBSOCKET_PAGE_SIZE", "500"))
+
+async def send_websocket_json(websocket, payload):
+    await websocket.send_text(dumps(payload).decode())
+
+async def send_job_state(websocket, job_id, last_id, logger):
+    """
+    Sends the job's status and any tickets classified after `last_id`, read from Mongo.
+    Returns the job status (None if there's no such job) and the last ticket id sent.
+    """
+    response = await checkClassificationTaskStatus(logger, job_id)
+    if response is None:
+        await websocket.send_json({"message": "No Classification Job Found", "classified_tickets": []})
+        return None, last_id
+    if response["status"]=='FAILED':
+        await websocket.send_json({"message": "Classification FAILED", "classified_tickets": []})
+        return response["status"], last_id
+
+    # Tickets are sent in pages as the cursor yields them, so large jobs never sit in memory at once
+    page = []
+    async for doc in iterClassificationResults(job_id, after_id=last_id):
+        page.append(doc)
+        last_id = str(doc["_id"])
+        if len(page) == WEBSOCKET_PAGE_SIZE:
+            await send_websocket_json(websocket, {"message": "Classification Progress", "classified_tickets": page, "progress": response["progress"]})
+            page = []
+    if response["status"]=='COMPLETED':
+        # Remaining classified tickets are sent with the completion message
+        await send_websocket_json(websocket, {"message": "Classification Completed", "classified_tickets": page, "stats": response["stats"]})
+    elif page:
+        await send_websocket_json(websocket, {"message": "Classification Progress", "classified_tickets": page, "progress": response["progress"]})
+    return response["status"], last_id
+
 @app.websocket("/ws/classification/{job_id}")
 async def websocket_classification(websocket: WebSocket, job_id: str):
     await websocket.accept()
     # logger = None  # Add your logging logic here if needed
     request_id = str(uuid.uuid4())  
-    logger = logging.LoggerAdapter(logging.getLogger("app_logger"), {"request_id": request_id})
+    logger = logging.LoggerAdapter(logging.getLogger("app_logger"), {"request_id": request_id, "job_id": job_id})
     logger.info(f"WebSocket connection established for job_id: {job_id}")
+    # Subscribe before reading the current state so no batch falls in between
+    events = job_event_bus.subscribe(job_id)
+    watcher = None
+    if JOB_EVENTS_BACKEND == "changestream":
+        watcher = asyncio.create_task(watch_job_changes(job_id, events))
     try:
-        while True:
-            # Periodically check classification status
-            response = await checkClassificationTaskStatus(logger, job_id)
-
-            if response and response["status"]=='COMPLETED':
-                results = await getClassificationResults(job_id, logger)
-
-                # Send classified tickets once the job is complete
-                await websocket.send_json({"message": "Classification Completed", "classified_tickets": results})
-                break  # Exit loop after sending data
-            elif response and response["status"]=='FAILED':
-                await websocket.send_json({"message": "Classification FAILED", "classified_tickets": []})
-                break  # Exit loop after sending data
-            elif response is None:
-                await websocket.send_json({"message": "No Classification Job Found", "classified_tickets": []})
-                break
-            await asyncio.sleep(5)  # Check status every 5 seconds
+        status, last_id = await send_job_state(websocket, job_id, None, logger)
+        while status == 'IN_PROGRESS':
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=JOB_EVENTS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                event = RESYNC_EVENT  # Fall back to polling Mongo when nothing is pushed
+
+            if event["type"] == "batch":
+                # Skip tickets already sent while catching up
+                batch = [ticket for ticket in event["classified_tickets"] if last_id is None or ObjectId(ticket["_id"]) > ObjectId(last_id)]
+                if batch:
+                    last_id = batch[-1]["_id"]
+                    await send_websocket_json(websocket, {"message": "Classification Progress", "classified_tickets": batch, "progress": event["progress"]})
+            else:
+                status, last_id = await send_job_state(websocket, job_id, last_id, logger)
 
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for job_id: {job_id}")
+        logger.info(f"WebSocket disconnected for job_id: {job_id}")
 
     except Exception as e:
         await websocket.send_json({"error": "Internal Error"})
-        print("Error:", e)
+        logger.error(f"WebSocket error for job_id {job_id}: {e}")
+
+    finally:
+        job_event_bus.unsubscribe(job_id, events)
+        if watcher:
+            watcher.cancel()
+
 
+# Upper bound for one page of results
+MAX_RESULTS_PAGE_SIZE = int(os.getenv("MAX_RESULTS_PAGE_SIZE", "5000"))
+
+async def stream_classified_tickets(first_doc, docs, limit, response_format):
+    """
+    Encodes tickets as the cursor yields them. One extra document is fetched to know whether a
+    next page exists; it isn't sent. JSON carries the next page token in "next", NDJSON in a final
+    {"next": token} line when there is another page.
+    """
+    count = 0
+    last_id = None
+    has_more = False
+    if response_format == "ndjson":
+        doc = first_doc
+        while doc is not None:
+            if limit and count == limit:
+                has_more = True
+                break
+            yield dumps(doc) + b"\n"
+            count += 1
+            last_id = doc["_id"]
+            doc = await anext(docs, None)
+        if has_more:
+            yield dumps({"next": encode_cursor(last_id)}) + b"\n"
+        return
+
+    yield b'{"message":"Classified Tickets Fetched","classified_tickets":['
+    doc = first_doc
+    while doc is not None:
+        if limit and count == limit:
+            has_more = True
+            break
+        yield (b"," if count else b"") + dumps(doc)
+        count += 1
+        last_id = doc["_id"]
+        doc = await anext(docs, None)
+    yield b'],"next":' + dumps(encode_cursor(last_id) if has_more else None) + b"}"
 
 @app.get("/classified_tickets/{job_id}")
-async def get_classified_tickets(job_id:str, request:Request):
+async def get_classified_tickets(job_id:str, request:Request, limit:int = 0, after:str = None, format:str = "json"):
+    """
+    Streams a job's classified tickets. `limit` pages the results (0 streams them all),
+    `after` is the `next` token of the previous page and `format` is "json" or "ndjson".
+    """
     logger = get_logger(request)
     logger.info("Request for classification result received")
-    print(job_id)
-    results =  list(await getClassificationResults(job_id, logger))
-    print(results)
-    if results:
-        return JSONResponse(
-            status_code=200, content={"message":"Classified Tickets Fetched", "classified_tickets":results}
-        )
-    else:
+    if limit < 0 or limit > MAX_RESULTS_PAGE_SIZE or format not in ("json", "ndjson"):
+        return JSONResponse(status_code=400, content={"message":f"limit must be between 0 and {MAX_RESULTS_PAGE_SIZE} and format json or ndjson", "classified_tickets":[]})
+    try:
+        after_id = decode_cursor(after) if after else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message":str(e), "classified_tickets":[]})
+
+    docs = iterClassificationResults(job_id, after_id=after_id, limit=limit + 1 if limit else None)
+    first_doc = await anext(docs, None)
+    if first_doc is None:
         return JSONResponse(status_code=404, content={"message":"No Classified ticket found with this job", "classified_ticekts":[]})
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream_classified_tickets(first_doc, docs, limit, format), media_type=media_type)
     
 
 @app.put("/save_edit")
@@ -176,12 +352,60 @@ async def train_chatgpt(request:Request, data: TicketRequest):
             status_code=400,
             content={"message":"No tickets found for classification", "classified_tickets":[]}
         )
-    print(tickets)
+    logger.debug(f"Labelling {len(tickets)} tickets with LLM model")
     return await train_with_chatgpt(tickets, logger)
 
 @app.post("/train_model")
 async def train(request:Request):
     logger = get_logger(request)
     logger.info("Request to train model received")
-    return train_model(logger)
+    try:
+        training_job_id = await training_job_runner.submit(logger)
+    except TrainingJobActive as e:
+        logger.warning(str(e))
+        return JSONResponse(status_code=409, content={"message":str(e), "training_job_id":e.job_id})
+    return JSONResponse(status_code=202, content={"message":"Model Training Started", "training_job_id":training_job_id})
+
+@app.get("/train_model/{training_job_id}")
+async def training_status(request:Request, training_job_id: str):
+    logger = get_logger(request)
+    logger.info("Request for training job status received")
+    job = await training_job_runner.status(training_job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message":"No Training Job Found"})
+    return JSONResponse(status_code=200, content={"message":"Fetched Training Job Status", **job})
+
+@app.post("/train_model/{training_job_id}/cancel")
+async def cancel_training(request:Request, training_job_id: str):
+    logger = get_logger(request)
+    logger.info("Request to cancel training job received")
+    if not await training_job_runner.cancel(training_job_id):
+        return JSONResponse(status_code=409, content={"message":"Training job isn't running"})
+    return JSONResponse(status_code=202, content={"message":"Training Job Cancellation Requested"})
+
+@app.get("/model_versions")
+async def model_versions(request:Request):
+    logger = get_logger(request)
+    logger.info("Request for model versions received")
+    versions = await asyncio.to_thread(model_store.list_versions)
+    return JSONResponse(status_code=200, content={"message":"Model versions", "versions":versions})
+
+@app.post("/model_versions/rollback")
+async def rollback_model(request:Request, version_id: str = None):
+    logger = get_logger(request)
+    logger.info(f"Request to roll back model to {version_id or 'the previous version'} received")
+    try:
+        promoted_version = await asyncio.to_thread(model_store.rollback, version_id)
+    except FileNotFoundError as e:
+        return JSONResponse(status_code=404, content={"message":str(e)})
+    model_registry.reload()
+    logger.info(f"Serving model version {promoted_version}")
+    return JSONResponse(status_code=200, content={"message":"Model rolled back", "model_version":promoted_version})
+
+@app.get("/metrics")
+async def metrics():
+    JOB_QUEUE_DEPTH.set(job_scheduler.queue_depth())
+    RUNNING_JOBS.set(len(job_scheduler.running_jobs))
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
@@ -0,0 +1,257 @@
+"""
+Classifies a large JSON or NDJSON file of tickets offline and saves them to `tickets`, for backfills.
+
+Usage (from the repository root):
+    python -m scripts.bulk_classify tickets.ndjson [--workers 8] [--chunk-size 1000]
+    python -m scripts.bulk_classify --resume JOB_ID
+
+Records in another shape are mapped with --map TICKET_FIELD=RECORD_FIELD and --default
+TICKET_FIELD=VALUE, e.g. for the backlog in requests.jsonl:
+    python -m scripts.bulk_classify requests.jsonl --map ticket_id=request_id \\
+        --map description=body --default product=Backlog
+
+The run is recorded as a classification job, so the API serves its results and stats like any
+upload. Chunks are embedded and classified across a process pool and saved in input order, and
+after each one the job's checkpoint records how much of the input is saved. Tickets get ids
+derived from the job and their input position: a resumed run skips everything checkpointed, and
+re-saving chunks that were in flight when the run stopped inserts nothing twice.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+import logging_config  # Configures app_logger handlers in this process
+from services.database import createClassificationJob, heartbeatJobs, saveJobCheckpoint, updateJobStatus
+from services.job_scheduler import JOB_HEARTBEAT_INTERVAL, JOB_ORPHAN_TIMEOUT
+from services.similarity_index import similarity_index
+from services.ticket_classification import CLASSIFICATION_CHUNK_SIZE, JOB_TIMINGS, KNN_FAST_PATH, build_ticket_documents, embed_and_classify
+from utils.connection import get_async_collection
+from utils.embeddings import set_default_threads
+from utils.metrics import stage_timer
+from utils.ticket_stream import iter_tickets, iter_file_chunks
+from utils.validateFile import isAllColumnsPresent
+
+DUPLICATE_KEY_ERROR = 11000
+
+def parse_assignments(values, option):
+    assignments = {}
+    for value in values or []:
+        field, separator, source = value.partition("=")
+        if not separator or not field:
+            raise SystemExit(f"{option} expects FIELD=VALUE, got {value!r}")
+        assignments[field] = source
+    return assignments
+
+def map_record(record, mapping, defaults):
+    """Returns the ticket for an input record, or None when it has no description or product."""
+    if not isinstance(record, dict):
+        return None
+    ticket = {**defaults, **record}
+    for field, source in mapping.items():
+        if source in record:
+            ticket[field] = record[source]
+    if not isAllColumnsPresent([ticket]):
+        return None
+    ticket.setdefault("ticket_id", None)
+    ticket.setdefault("created_date", None)
+    return ticket
+
+def iter_positioned_chunks(path, mapping, defaults, chunk_size, start):
+    """
+    Yields (end position, [(position, ticket)]) for the records of `path` from position `start`.
+    Positions count every input record, so records that aren't tickets are skipped without
+    shifting the positions of the rest.
+    """
+    chunk = []
+    end = start
+    for position, record in enumerate(iter_tickets(iter_file_chunks(path))):
+        if position < start:
+            continue
+        ticket = map_record(record, mapping, defaults)
+        if ticket is not None:
+            chunk.append((position, ticket))
+        end = position + 1
+        if (end - start) % chunk_size == 0:
+            yield end, chunk
+            chunk = []
+    if (end - start) % chunk_size:
+        yield end, chunk
+
+def document_id(id_prefix, position):
+    """Deterministic ObjectId of the ticket at an input position: 7 bytes of the job, 5 of the position."""
+    return ObjectId(bytes.fromhex(id_prefix) + position.to_bytes(5, "big"))
+
+async def save_documents(documents, timings):
+    """Inserts a chunk, ignoring tickets already saved by an earlier attempt."""
+    with stage_timer("bulk_classify", "mongo_write", timings):
+        try:
+            await get_async_collection("tickets").insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details["writeErrors"]):
+                raise
+
+async def heartbeat(owner):
+    # Keeps the API's job scheduler from reclaiming the job while this run holds it
+    while True:
+        await heartbeatJobs(owner)
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+
+async def start_job(args, logger, owner):
+    """Creates the job for a new run, or takes over the job to resume. Returns (job id, checkpoint)."""
+    now = datetime.now(timezone.utc)
+    jobs_collection = get_async_collection("jobs")
+    if args.resume:
+        # Taken over atomically, and only once its previous run stopped heartbeating, so two
+        # live runs never interleave checkpoints
+        stale_before = (now - timedelta(seconds=JOB_ORPHAN_TIMEOUT)).isoformat()
+        job = await jobs_collection.find_one_and_update(
+            {
+                "job_id":args.resume,
+                "checkpoint":{"$exists":True},
+                "Status":{"$ne":"COMPLETED"},
+                "$or":[
+                    {"Status":{"$ne":"IN_PROGRESS"}},
+                    {"heartbeatAt":{"$lt":stale_before}},
+                    {"heartbeatAt":{"$exists":False}}
+                ]
+            },
+            {"$set":{"Status":"IN_PROGRESS", "owner":owner, "heartbeatAt":now.isoformat(), "updatedAt":now.isoformat()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            return args.resume, job["checkpoint"]
+        job = await jobs_collection.find_one({"job_id":args.resume, "checkpoint":{"$exists":True}})
+        if job is None:
+            raise SystemExit(f"No bulk classification job {args.resume}")
+        if job["Status"] == "COMPLETED":
+            raise SystemExit(f"Job {args.resume} is already completed")
+        raise SystemExit(
+            f"Job {args.resume} is still running as {job.get('owner')} (last heartbeat {job.get('heartbeatAt')}); "
+            f"it can be resumed once it has not heartbeated for {JOB_ORPHAN_TIMEOUT}s"
+        )
+
+    if not args.input:
+        raise SystemExit("An input file or --resume JOB_ID is required")
+    checkpoint = {
+        "input": os.path.abspath(args.input),
+        "mapping": parse_assignments(args.map, "--map"),
+        "defaults": parse_assignments(args.default, "--default"),
+        "chunk_size": args.chunk_size,
+        "id_prefix": (int(time.time()).to_bytes(4, "big") + os.urandom(3)).hex(),
+        "position": 0
+    }
+    job_id = await createClassificationJob(logger, {"owner":owner, "heartbeatAt":now.isoformat(), "checkpoint":checkpoint})
+    return job_id, checkpoint
+
+class ThroughputReporter:
+    def __init__(self, start_position, interval):
+        self.interval = interval
+        self.started = self.last_report = time.perf_counter()
+        self.start_position = self.last_position = start_position
+        self.saved = 0
+
+    def update(self, position, saved, force=False):
+        self.saved += saved
+        now = time.perf_counter()
+        if not force and now - self.last_report < self.interval:
+            return
+        overall = (position - self.start_position) / max(now - self.started, 1e-9)
+        recent = (position - self.last_position) / max(now - self.last_report, 1e-9)
+        print(f"position {position}: saved {self.saved} tickets this run, "
+              f"{overall:.1f} records/s overall, {recent:.1f} records/s recently", flush=True)
+        self.last_report, self.last_position = now, position
+
+async def run(args):
+    owner = f"bulk-classify-{uuid4()}"
+    logger = logging.LoggerAdapter(logging.getLogger("app_logger"), {"request_id": owner})
+    job_id, checkpoint = await start_job(args, logger, owner)
+    logger = logging_config.get_job_logger(logger, job_id)
+    start = checkpoint["position"]
+    logger.info(f"Bulk classifying {checkpoint['input']} from record {start} as job {job_id}")
+    print(f"job {job_id}, resume with: python -m scripts.bulk_classify --resume {job_id}", flush=True)
+
+    heartbeat_task = asyncio.create_task(heartbeat(owner))
+    workers = max(1, args.workers)
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=set_default_threads,
+        initargs=(max(1, (os.cpu_count() or 1) // workers),)
+    )
+    loop = asyncio.get_running_loop()
+    reporter = ThroughputReporter(start, args.report_interval)
+    pending = deque()
+    position = start
+    try:
+        if KNN_FAST_PATH:
+            # kNN votes use every ticket saved before the run
+            await asyncio.to_thread(similarity_index.refresh, logger)
+        chunks = iter_positioned_chunks(
+            checkpoint["input"], checkpoint["mapping"], checkpoint["defaults"], checkpoint["chunk_size"], start
+        )
+        exhausted = False
+        while not exhausted or pending:
+            if not exhausted and len(pending) < workers * 2:
+                # Reading and parsing the file is blocking I/O
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    end, positioned = chunk
+                    texts = [ticket["description"] + " in " + ticket["product"] for _, ticket in positioned]
+                    future = loop.run_in_executor(executor, embed_and_classify, texts) if texts else None
+                    pending.append((end, positioned, future))
+                continue
+
+            # Chunks are saved and checkpointed in input order, so the checkpoint never skips a chunk
+            end, positioned, future = pending.popleft()
+            saved = 0
+            stats, timings = {}, {}
+            if future is not None:
+                vector_embeddings, classification_results, stats, timings = await future
+                documents = build_ticket_documents(
+                    job_id, [ticket for _, ticket in positioned], vector_embeddings, classification_results, logger,
+                    document_ids=[document_id(checkpoint["id_prefix"], position) for position, _ in positioned]
+                )
+                if documents:
+                    await save_documents(documents, timings)
+                saved = len(documents)
+            await saveJobCheckpoint(job_id, end, stats, timings if JOB_TIMINGS else None)
+            position = end
+            reporter.update(position, saved)
+        await updateJobStatus(job_id, "COMPLETED")
+        reporter.update(position, 0, force=True)
+        logger.info(f"Bulk classification job {job_id} completed")
+    except BaseException as e:
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+        logger.error(f"Bulk classification job {job_id} stopped: {e!r}. Resume with --resume {job_id}")
+        await updateJobStatus(job_id, "FAILED")
+        raise
+    finally:
+        heartbeat_task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", help="JSON ({\"tickets\": [...]}) or NDJSON file")
+    parser.add_argument("--resume", metavar="JOB_ID", help="continue a stopped run from its checkpoint")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="classification processes")
+    parser.add_argument("--chunk-size", type=int, default=CLASSIFICATION_CHUNK_SIZE, help="records per chunk")
+    parser.add_argument("--map", action="append", metavar="FIELD=SOURCE", help="take a ticket field from another record field")
+    parser.add_argument("--default", action="append", metavar="FIELD=VALUE", help="value of a ticket field missing from a record")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between throughput reports")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Checks an embedding backend against the fp32 vectors already stored on tickets.
+
+Usage (from the repository root):
+    python -m scripts.embedding_parity --backend onnx-int8 [--sample 1000] [--max-drift 0.02]
+
+Re-embeds a random sample of stored tickets with the backend (bypassing the embedding cache)
+and reports the cosine drift (1 - cosine similarity) from their stored vectors, along with the
+backend's encoding throughput. Exits with status 1 when the mean drift exceeds --max-drift.
+Only tickets embedded by the torch backend make a meaningful baseline.
+"""
+import argparse
+import sys
+import time
+import numpy as np
+from utils.clustering import ticket_text
+from utils.connection import get_mongo_collection
+from utils.embedding_backends import BACKENDS, load_backend
+from utils.embeddings import EMBEDDING_MODEL_NAME, EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE
+from utils.vector_codec import decode_vector
+
+def sample_tickets(size):
+    return list(get_mongo_collection("tickets").aggregate([
+        {"$match": {"vectorized_data": {"$exists": True}}},
+        {"$sample": {"size": size}},
+        {"$project": {"description": 1, "product": 1, "vectorized_data": 1}}
+    ]))
+
+def cosine_similarities(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.einsum("ij,ij->i", a, b)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, required=True)
+    parser.add_argument("--sample", type=int, default=1000, help="stored tickets to compare")
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS, help="intra-op threads, 0 for the runtime default")
+    parser.add_argument("--max-drift", type=float, default=0.02, help="allowed mean cosine drift")
+    args = parser.parse_args()
+
+    tickets = sample_tickets(args.sample)
+    if not tickets:
+        print("No stored ticket vectors to compare against")
+        sys.exit(1)
+    stored = np.stack([decode_vector(ticket["vectorized_data"]) for ticket in tickets])
+
+    model = load_backend(args.backend, EMBEDDING_MODEL_NAME, args.threads)
+    texts = [ticket_text(ticket) for ticket in tickets]
+    model.encode(texts[:8], batch_size=EMBEDDING_BATCH_SIZE)  # Warm up before timing
+    start = time.perf_counter()
+    vectors = model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, convert_to_numpy=True).astype(np.float32)
+    elapsed = time.perf_counter() - start
+
+    drift = 1 - cosine_similarities(stored, vectors)
+    print(f"backend {args.backend}: {len(texts)} tickets in {elapsed:.2f}s ({len(texts) / elapsed:.1f} tickets/s)")
+    print(f"cosine drift mean {drift.mean():.5f}, p50 {np.percentile(drift, 50):.5f}, "
+          f"p99 {np.percentile(drift, 99):.5f}, max {drift.max():.5f}")
+    if drift.mean() > args.max_drift:
+        print(f"Mean drift exceeds {args.max_drift}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Measures LLM labelling throughput, normally against scripts/llm_stub_server.py.
+
+Usage (from the repository root):
+    OPENAI_BASE_URL=http://localhost:8001/v1 LLM_CONCURRENCY=8 \
+        python -m scripts.llm_load_test [--tickets 200] [--batch-size 1] [--no-cache]
+
+Without --no-cache a second run over the same tickets is served from the response cache.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from services.train_with_chatgpt import label_ticket_texts
+from utils import llm_client
+
+WORDS = [
+    "license", "expired", "renewal", "fvu", "generation", "failed", "challan", "tds", "return",
+    "form24q", "form26q", "login", "error", "download", "report", "import", "excel", "payment"
+]
+
+def synthetic_texts(count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=8)) + f" ticket {i}" for i in range(count)]
+
+async def run(args):
+    logger = logging.getLogger("llm_load_test")
+    texts = synthetic_texts(args.tickets)
+    start = time.perf_counter()
+    labels = await label_ticket_texts(texts, logger, batch_size=args.batch_size, use_cache=not args.no_cache)
+    elapsed = time.perf_counter() - start
+    labelled = sum(1 for label in labels if label.get("category"))
+    print(f"labelled {labelled}/{len(texts)} tickets in {elapsed:.2f}s "
+          f"({len(texts) / elapsed:.1f} tickets/s, concurrency {llm_client.LLM_CONCURRENCY}, "
+          f"batch size {args.batch_size})")
+    print(f"llm calls: {llm_client.llm_call_stats}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1, help="tickets per prompt")
+    parser.add_argument("--no-cache", action="store_true", help="always call the LLM")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
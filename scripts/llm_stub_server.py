@@ -0,0 +1,79 @@
+"""
+OpenAI-compatible stub of the chat completions endpoint, for running LLM labelling offline.
+
+Usage (from the repository root):
+    uvicorn scripts.llm_stub_server:app --port 8001
+    OPENAI_BASE_URL=http://localhost:8001/v1 uvicorn main:app
+
+Tickets are labelled deterministically with the metadata.json feature whose name and
+description share the most words with the ticket. STUB_LATENCY_MS adds a fixed delay
+per request and STUB_ERROR_RATE returns that fraction of requests as 429s, to exercise
+concurrency limits and retries.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+METADATA_PATH = "metadata.json"
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "200"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+
+SINGLE_TICKET = re.compile(r'Ticket Description:\s*"(.*)"\s*$', re.S)
+NUMBERED_TICKET = re.compile(r'^\s*(\d+)\. "(.*)"\s*$', re.M)
+WORD = re.compile(r"[a-z0-9]+")
+
+app = FastAPI()
+
+with open(METADATA_PATH, "r", encoding="utf-8") as f:
+    features = [
+        (feature["feature_name"], set(WORD.findall((feature["feature_name"] + " " + feature["description_metadata"]).lower())))
+        for feature in json.load(f)
+    ]
+
+def label(ticket_text):
+    words = set(WORD.findall(ticket_text.lower()))
+    best_name, best_overlap = "Others", 0
+    for name, feature_words in features:
+        overlap = len(words & feature_words)
+        if overlap > best_overlap:
+            best_name, best_overlap = name, overlap
+    confidence_score = round(min(0.99, 0.3 + 0.1 * best_overlap), 2) if best_overlap else 0.2
+    return {"category": best_name, "confidence_score": confidence_score}
+
+def answer(prompt):
+    tickets_section = prompt.split("Ticket Descriptions:", 1)
+    if len(tickets_section) == 2:
+        return {"classifications": [
+            {"ticket": int(number), **label(text)}
+            for number, text in NUMBERED_TICKET.findall(tickets_section[1])
+        ]}
+    match = SINGLE_TICKET.search(prompt)
+    return label(match.group(1) if match else "")
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    if random.random() < STUB_ERROR_RATE:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}
+        )
+    prompt = body["messages"][-1]["content"]
+    return {
+        "id": f"chatcmpl-stub-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(answer(prompt))},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
@@ -0,0 +1,59 @@
+"""
+Rewrites vectors stored as BSON arrays into packed binary blobs.
+
+Usage (from the repository root):
+    python -m scripts.migrate_vectors [--dtype float32|float16] [--batch-size 1000] [--dry-run]
+
+Readers accept both formats, so this can run while the API is serving traffic.
+"""
+import argparse
+from pymongo import UpdateOne
+from utils.connection import get_mongo_collection
+from utils.vector_codec import encode_vector, VECTOR_STORAGE_DTYPE, BINARY_SUBTYPES
+
+# collection name -> field holding the vector
+VECTOR_FIELDS = {
+    "tickets": "vectorized_data",
+    "classified_tickets": "vectorized_data",
+    "chatgpt_trained_tickets": "vectorized_data",
+    "embeddings_cache": "embedding",
+}
+
+def migrate_collection(collection_name, field, dtype, batch_size, dry_run):
+    collection = get_mongo_collection(collection_name)
+    query = {field: {"$type": "array"}}
+    if dry_run:
+        count = collection.count_documents(query)
+        print(f"{collection_name}: {count} documents to migrate")
+        return count
+
+    migrated = 0
+    operations = []
+    for document in collection.find(query, {field: 1}).batch_size(batch_size):
+        # Match on the array type too, so a concurrent rewrite isn't overwritten
+        operations.append(UpdateOne(
+            {"_id": document["_id"], field: {"$type": "array"}},
+            {"$set": {field: encode_vector(document[field], dtype)}}
+        ))
+        if len(operations) == batch_size:
+            migrated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"{collection_name}: {migrated} documents migrated")
+    if operations:
+        migrated += collection.bulk_write(operations, ordered=False).modified_count
+    print(f"{collection_name}: done, {migrated} documents migrated")
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored vectors to packed binary format")
+    parser.add_argument("--dtype", choices=sorted(BINARY_SUBTYPES), default=VECTOR_STORAGE_DTYPE)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--collections", nargs="+", choices=sorted(VECTOR_FIELDS), default=list(VECTOR_FIELDS))
+    parser.add_argument("--dry-run", action="store_true", help="Only count documents still stored as arrays")
+    args = parser.parse_args()
+
+    for collection_name in args.collections:
+        migrate_collection(collection_name, VECTOR_FIELDS[collection_name], args.dtype, args.batch_size, args.dry_run)
+
+if __name__ == "__main__":
+    main()
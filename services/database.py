@@ -1,28 +1,44 @@
-from utils.connection import get_mongo_collection
+from utils.connection import get_mongo_collection, get_async_collection, CURSOR_BATCH_SIZE
 from uuid import uuid4
 from datetime import datetime, timezone
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from utils.bulk_writer import BulkWriter
+from utils.metrics import timed_db_operation
 
+def upsert_ticket(ticket, now):
+    """
+    Upserts a ticket by ticket_id. updatedAt lets the similarity index pick up the changed row;
+    createdAt is set on insert only, so training still tells edited tickets from new ones.
+    """
+    update = {"$set": {**ticket, "updatedAt": now}}
+    if "createdAt" not in ticket:
+        update["$setOnInsert"] = {"createdAt": now}
+    return UpdateOne({"ticket_id": ticket["ticket_id"]}, update, upsert=True)
+
+@timed_db_operation
 def save_tickets(tickets):
-    """Save multiple tickets to MongoDB."""
+    """Save multiple tickets to MongoDB. Returns the per-batch write results."""
     collection = get_mongo_collection("tickets")
-    for ticket in tickets:
-        collection.update_one(
-            {"ticket_id": ticket["ticket_id"]}, 
-            {"$set": ticket}, 
-            upsert=True
-        )
+    now = datetime.now(timezone.utc).isoformat()
+    with BulkWriter(collection) as writer:
+        for ticket in tickets:
+            writer.add(upsert_ticket(ticket, now))
+    return writer.results
 
+@timed_db_operation
 def get_tickets():
     """Fetch all tickets from MongoDB."""
     collection = get_mongo_collection("tickets")
     return list(collection.find({}, {"_id": 0}))
 
+@timed_db_operation
 def get_ticket_by_id(ticket_id):
     """Fetch a single ticket from MongoDB."""
     collection = get_mongo_collection("tickets")
     return collection.find_one({"ticket_id": ticket_id}, {"_id": 0})
 
+@timed_db_operation
 def save_user_edit(data):
     """Update a ticket with user-edited category."""
     collection = get_mongo_collection("tickets")
@@ -35,48 +51,65 @@ def save_user_edit(data):
         }}
     )
 
+@timed_db_operation
 def save_chatgpt_trained_tickets(tickets):
     """Save ChatGPT classified tickets to a separate collection and main database."""
     collection = get_mongo_collection("chatgpt_trained_tickets")
     main_collection = get_mongo_collection("tickets")
     
-    for ticket in tickets:
-        collection.update_one({"ticket_id": ticket["ticket_id"]}, {"$set": ticket}, upsert=True)
-        main_collection.update_one({"ticket_id": ticket["ticket_id"]}, {"$set": ticket}, upsert=True)
+    now = datetime.now(timezone.utc).isoformat()
+    with BulkWriter(collection) as writer, BulkWriter(main_collection) as main_writer:
+        for ticket in tickets:
+            operation = upsert_ticket(ticket, now)
+            writer.add(operation)
+            main_writer.add(operation)
+    return writer.results + main_writer.results
 
+@timed_db_operation
 def log_training(data):
     """Log model training history."""
     collection = get_mongo_collection("training_logs")
     collection.insert_one(data)
 
-async def createClassificationJob(logger):
+@timed_db_operation
+async def createClassificationJob(logger, job_fields=None):
     job_id = str(uuid4())
     request_id = logger.extra['request_id']
-    jobs_collection = get_mongo_collection("jobs")
-    jobs_collection.insert_one(
+    jobs_collection = get_async_collection("jobs")
+    await jobs_collection.insert_one(
         {"job_id":job_id, 
          "request_id":request_id, 
          "Status":"IN_PROGRESS",
          "createdAt":datetime.now(timezone.utc).isoformat(),
-        "updatedAt":datetime.now(timezone.utc).isoformat()
+        "updatedAt":datetime.now(timezone.utc).isoformat(),
+        **(job_fields or {})
         })
     return job_id
 
+@timed_db_operation
 async def checkClassificationTaskStatus(logger, job_id):
-    jobs_collection = get_mongo_collection("jobs")
-    job = jobs_collection.find_one({"job_id":job_id})
+    jobs_collection = get_async_collection("jobs")
+    job = await jobs_collection.find_one({"job_id":job_id}, {"Status":1, "progress":1, "classification_stats":1})
     if not job:
         return None
-    return {"message":"Fetched Job Status", "status":job['Status']}
-
-async def getClassificationResults(job_id, logger):
-    classification_collection = get_mongo_collection("tickets")
-    result =  classification_collection.find({"job_id":job_id},{"vectorized_data":0})
-    print(result)
-    result = [serialize_mongo_document(doc) for doc in result]
+    return {
+        "message":"Fetched Job Status",
+        "status":job['Status'],
+        "progress":job.get('progress'),
+        "stats":summarize_job_stats(job.get('classification_stats'))
+    }
 
-    logger.info("Retrieved Classified Tickets")
-    return result
+async def iterClassificationResults(job_id, after_id=None, limit=None):
+    """Yields a job's classified tickets in _id order straight from the cursor, without the vectors."""
+    classification_collection = get_async_collection("tickets")
+    query = {"job_id":job_id}
+    if after_id:
+        query["_id"] = {"$gt":ObjectId(after_id)}
+    cursor = classification_collection.find(query,{"vectorized_data":0}).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for doc in cursor.batch_size(min(limit or CURSOR_BATCH_SIZE, CURSOR_BATCH_SIZE)):
+        yield doc
 
 def serialize_mongo_document(doc):
     """Converts MongoDB ObjectId to a string for JSON serialization."""
@@ -85,11 +118,158 @@ def serialize_mongo_document(doc):
         "_id": str(doc["_id"]) if "_id" in doc else None  # Convert ObjectId to string explicitly
     }
 
+@timed_db_operation
+async def updateJobStatus(job_id, status):
+    jobs_collection = get_async_collection("jobs")
+    await jobs_collection.update_one(
+        {"job_id":job_id},
+        {"$set":{"Status":status, "updatedAt":datetime.now(timezone.utc).isoformat()}}
+    )
+
+@timed_db_operation
+async def updateJobProgress(job_id, processed, total=None):
+    jobs_collection = get_async_collection("jobs")
+    now = datetime.now(timezone.utc).isoformat()
+    await jobs_collection.update_one(
+        {"job_id":job_id},
+        {"$set":{"progress":{"processed":processed, "total":total}, "updatedAt":now, "heartbeatAt":now}}
+    )
+
+@timed_db_operation
+async def incrementJobStats(job_id, stats, timings=None):
+    """Adds a chunk's classification counts, and optionally its stage timings, to the job's running totals."""
+    increments = {f"classification_stats.{key}":value for key, value in stats.items()}
+    increments.update({f"timings.{stage}":seconds for stage, seconds in (timings or {}).items()})
+    jobs_collection = get_async_collection("jobs")
+    await jobs_collection.update_one({"job_id":job_id}, {"$inc":increments})
+
+def summarize_job_stats(stats):
+    """Adds the share of tickets served by the nearest-neighbour fast path to a job's stats."""
+    if not stats:
+        return None
+    classified = stats.get("knn_tickets", 0) + stats.get("model_tickets", 0)
+    return {**stats, "knn_fraction":stats.get("knn_tickets", 0) / classified if classified else 0.0}
+
+@timed_db_operation
+async def deleteJobTickets(job_id):
+    """Discards a job's saved tickets and the stats counted for them."""
+    classification_collection = get_async_collection("tickets")
+    await classification_collection.delete_many({"job_id":job_id})
+    await get_async_collection("jobs").update_one({"job_id":job_id}, {"$unset":{"classification_stats":"", "timings":""}})
+
+@timed_db_operation
+async def saveJobCheckpoint(job_id, position, stats, timings=None):
+    """
+    Records that a bulk classification job has saved every input ticket before `position`,
+    together with that chunk's counts, so the job resumes from there.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    increments = {f"classification_stats.{key}":value for key, value in stats.items()}
+    increments.update({f"timings.{stage}":seconds for stage, seconds in (timings or {}).items()})
+    update = {"$set":{"checkpoint.position":position, "progress.processed":position, "updatedAt":now, "heartbeatAt":now}}
+    if increments:
+        update["$inc"] = increments
+    await get_async_collection("jobs").update_one({"job_id":job_id}, update)
+
+@timed_db_operation
+async def heartbeatJobs(owner):
+    """Marks every in-progress job held by a scheduler as still alive."""
+    jobs_collection = get_async_collection("jobs")
+    await jobs_collection.update_many(
+        {"owner":owner, "Status":"IN_PROGRESS"},
+        {"$set":{"heartbeatAt":datetime.now(timezone.utc).isoformat()}}
+    )
+
+@timed_db_operation
+async def claimOrphanedJob(owner, stale_before):
+    """
+    Atomically takes over one in-progress job whose scheduler stopped heartbeating.
+    Returns the claimed job document, or None when there is nothing to reclaim.
+    """
+    jobs_collection = get_async_collection("jobs")
+    return await jobs_collection.find_one_and_update(
+        {
+            "Status":"IN_PROGRESS",
+            "owner":{"$ne":owner},
+            "$or":[{"heartbeatAt":{"$lt":stale_before}}, {"heartbeatAt":{"$exists":False}}]
+        },
+        {"$set":{"owner":owner, "heartbeatAt":datetime.now(timezone.utc).isoformat()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+@timed_db_operation
+async def createTrainingJob(logger):
+    """
+    Records a queued training job and returns its id.
+    Raises DuplicateKeyError if another training job is still active.
+    """
+    job_id = str(uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    training_jobs_collection = get_async_collection("training_jobs")
+    await training_jobs_collection.insert_one(
+        {"job_id":job_id,
+         "request_id":logger.extra['request_id'],
+         "Status":"QUEUED",
+         # Unique among active jobs, so only one training runs at a time
+         "active":True,
+         "progress":{"processed":0, "total":None},
+         "createdAt":now,
+         "updatedAt":now,
+         "heartbeatAt":now
+        })
+    return job_id
+
+@timed_db_operation
+async def getTrainingJob(job_id):
+    training_jobs_collection = get_async_collection("training_jobs")
+    return await training_jobs_collection.find_one({"job_id":job_id}, {"_id":0, "active":0})
+
+@timed_db_operation
+async def getActiveTrainingJob():
+    training_jobs_collection = get_async_collection("training_jobs")
+    return await training_jobs_collection.find_one({"active":True}, {"_id":0, "active":0})
+
+@timed_db_operation
+async def cancelTrainingJob(job_id):
+    """Flags an active training job for cancellation. Returns False if it isn't active."""
+    training_jobs_collection = get_async_collection("training_jobs")
+    result = await training_jobs_collection.update_one(
+        {"job_id":job_id, "active":True},
+        {"$set":{"cancelRequested":True, "updatedAt":datetime.now(timezone.utc).isoformat()}}
+    )
+    return result.matched_count > 0
+
+@timed_db_operation
+async def finishTrainingJob(job_id, status, result=None):
+    """Records the outcome of a training job unless the training process already did."""
+    training_jobs_collection = get_async_collection("training_jobs")
+    await training_jobs_collection.update_one(
+        {"job_id":job_id, "active":True},
+        {
+            "$set":{"Status":status, "result":result, "updatedAt":datetime.now(timezone.utc).isoformat()},
+            "$unset":{"active":""}
+        }
+    )
+
+@timed_db_operation
+async def failStaleTrainingJobs(stale_before):
+    """Fails active training jobs whose process stopped heartbeating, e.g. after a restart."""
+    training_jobs_collection = get_async_collection("training_jobs")
+    await training_jobs_collection.update_many(
+        {"active":True, "heartbeatAt":{"$lt":stale_before}},
+        {
+            "$set":{"Status":"FAILED", "result":{"error":"Training process stopped responding"},
+                    "updatedAt":datetime.now(timezone.utc).isoformat()},
+            "$unset":{"active":""}
+        }
+    )
+
+@timed_db_operation
 async def updateCategoryClassification(data, logger):
     unique_id = data['id']
     updatedCategory = data['category']
-    classification_collection = get_mongo_collection("tickets")
+    classification_collection = get_async_collection("tickets")
     updated_time = datetime.now(timezone.utc).isoformat()
-    result = classification_collection.update_one({"_id":ObjectId(unique_id)},{"$set":{"classification_category":updatedCategory, "updatedAt":updated_time, "confidence_score":1}})
-    print(result)
+    result = await classification_collection.update_one({"_id":ObjectId(unique_id)},{"$set":{"classification_category":updatedCategory, "updatedAt":updated_time, "confidence_score":1}})
+    logger.debug(f"Updated category of ticket {unique_id}: {result.modified_count} modified")
     return result
@@ -0,0 +1,61 @@
+import asyncio
+import os
+from collections import defaultdict
+from utils.connection import get_async_collection
+
+# "local" pushes events from the job running in this process; "changestream" also
+# listens to Mongo change streams so a socket is notified of jobs run by other workers
+JOB_EVENTS_BACKEND = os.getenv("JOB_EVENTS_BACKEND", "local")
+JOB_EVENT_QUEUE_SIZE = int(os.getenv("JOB_EVENT_QUEUE_SIZE", "64"))
+# Sockets re-check the job in Mongo if no event arrives for this long. With the local backend a
+# socket on a worker that isn't running the job only learns of its progress this way
+JOB_EVENTS_POLL_INTERVAL = int(os.getenv("JOB_EVENTS_POLL_INTERVAL", "5" if JOB_EVENTS_BACKEND == "local" else "30"))
+
+# Tells a subscriber to re-read the job state from Mongo
+RESYNC_EVENT = {"type": "resync"}
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Slow subscriber: drop its backlog, it catches up from Mongo instead
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC_EVENT)
+
+class JobEventBus:
+    """In-process pub/sub of classification job events, keyed by job_id."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, job_id):
+        queue = asyncio.Queue(maxsize=JOB_EVENT_QUEUE_SIZE)
+        self.subscribers[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        subscribers = self.subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.subscribers[job_id]
+
+    def has_subscribers(self, job_id):
+        return job_id in self.subscribers
+
+    def publish(self, job_id, event):
+        for queue in list(self.subscribers.get(job_id, ())):
+            _offer(queue, event)
+
+async def watch_job_changes(job_id, queue):
+    """Forwards change stream notifications about a job into a subscriber queue. Needs a replica set."""
+    pipeline = [{"$match": {
+        "operationType": {"$in": ["update", "replace"]},
+        "fullDocument.job_id": job_id
+    }}]
+    async with get_async_collection("jobs").watch(pipeline, full_document="updateLookup") as stream:
+        async for _ in stream:
+            _offer(queue, RESYNC_EVENT)
+
+job_event_bus = JobEventBus()
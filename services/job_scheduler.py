@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from services.database import claimOrphanedJob, heartbeatJobs, updateJobStatus, deleteJobTickets
+from services.ticket_classification import classify_ticket_stream
+from logging_config import get_job_logger
+
+# Chunks of one job being embedded or classified at once, so one chunk's inference and save
+# overlap the next chunk's encode
+JOB_CHUNKS_IN_FLIGHT = int(os.getenv("JOB_CHUNKS_IN_FLIGHT", "2"))
+# Jobs classified at the same time; further jobs wait in the queue
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))
+# Jobs allowed to wait; submissions beyond this are rejected
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "20"))
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+# Jobs whose scheduler hasn't heartbeated for this long are reclaimed
+JOB_ORPHAN_TIMEOUT = int(os.getenv("JOB_ORPHAN_TIMEOUT", "120"))
+
+class JobQueueFull(Exception):
+    """Raised when the classification queue can't accept another job."""
+
+class ClassificationJobScheduler:
+    """
+    Runs classification jobs recorded in the `jobs` collection.
+    Embedding and inference run in threads of this process with the shared preloaded model;
+    at most MAX_CONCURRENT_JOBS jobs run at once and
+    up to JOB_QUEUE_SIZE more can wait. Every job held here is heartbeated, and in-progress jobs
+    whose scheduler stopped heartbeating (e.g. after a restart) are reclaimed.
+    """
+
+    def __init__(self, chunks_in_flight=JOB_CHUNKS_IN_FLIGHT, max_concurrent_jobs=MAX_CONCURRENT_JOBS,
+                 queue_size=JOB_QUEUE_SIZE):
+        self.chunks_in_flight = max(1, chunks_in_flight)
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.queue_size = queue_size
+        self.owner = str(uuid4())
+        self.queue = None
+        self.tasks = []
+        self.running_jobs = set()
+
+    async def start(self, logger):
+        self.logger = logger
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent_jobs)]
+        self.tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info(f"Job scheduler started for {self.max_concurrent_jobs} concurrent jobs")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def is_full(self):
+        return self.queue.full()
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def job_fields(self):
+        """Fields a new job needs so this scheduler owns it from creation."""
+        return {"owner": self.owner, "heartbeatAt": datetime.now(timezone.utc).isoformat()}
+
+    def submit(self, job_id, upload_path, logger, total=None):
+        """Queues a job. Raises JobQueueFull when the queue is at capacity."""
+        try:
+            self.queue.put_nowait((job_id, upload_path, logger, total))
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Classification queue is full ({self.queue_size} jobs waiting)")
+
+    async def _worker(self):
+        while True:
+            job_id, upload_path, logger, total = await self.queue.get()
+            logger = get_job_logger(logger, job_id)
+            self.running_jobs.add(job_id)
+            try:
+                await classify_ticket_stream(job_id, upload_path, logger, total=total, max_in_flight=self.chunks_in_flight)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Classification job {job_id} crashed: {e}")
+            finally:
+                self.running_jobs.discard(job_id)
+                self.queue.task_done()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await heartbeatJobs(self.owner)
+                await self.reclaim_orphaned_jobs()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Job scheduler heartbeat failed: {e}")
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    async def reclaim_orphaned_jobs(self):
+        """Requeues in-progress jobs abandoned by a stopped scheduler while there is room in the queue."""
+        stale_before = (datetime.now(timezone.utc) - timedelta(seconds=JOB_ORPHAN_TIMEOUT)).isoformat()
+        while not self.queue.full():
+            job = await claimOrphanedJob(self.owner, stale_before)
+            if job is None:
+                return
+            job_id = job["job_id"]
+            logger = logging.LoggerAdapter(logging.getLogger("app_logger"), {"request_id": job.get("request_id", "N/A")})
+            upload_path = job.get("upload_path")
+            if not upload_path or not os.path.exists(upload_path):
+                logger.warning(f"Orphaned job {job_id} has no upload to resume from")
+                await updateJobStatus(job_id, "FAILED")
+                continue
+            # Chunks saved before the crash are discarded, the job restarts from the beginning of its upload
+            await deleteJobTickets(job_id)
+            logger.info(f"Reclaimed orphaned classification job {job_id}")
+            self.submit(job_id, upload_path, logger, (job.get("progress") or {}).get("total"))
+
+job_scheduler = ClassificationJobScheduler()
@@ -0,0 +1,55 @@
+import joblib
+import os
+import threading
+from services.model_store import model_store
+
+# Unversioned artifact written before the model store existed, served until a version is promoted
+MODEL_PATH = "models/trained_model.pkl"
+
+class ModelRegistry:
+    """
+    Process-wide holder of the trained classifier.
+    The served version is loaded once, memory-mapped, and reloaded only when another
+    version is promoted in the model store.
+    """
+
+    def __init__(self, store=model_store, model_path=MODEL_PATH):
+        self.store = store
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        # (version, model) is swapped as a single reference so readers never see a mixed state
+        self._current = (None, None)
+
+    def _served_version(self):
+        """Identifies the model to serve: the promoted version id, or the legacy artifact's mtime and size."""
+        version_id = self.store.current_version()
+        if version_id is not None:
+            return version_id
+        stat = os.stat(self.model_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, version):
+        if isinstance(version, str):
+            return self.store.load(version)
+        return joblib.load(self.model_path)
+
+    def get_model(self):
+        """Returns the current model, loading it first if another version is being served."""
+        version = self._served_version()
+        current_version, model = self._current
+        if version == current_version:
+            return model
+
+        with self._lock:
+            current_version, model = self._current
+            if version != current_version:
+                model = self._load(version)
+                self._current = (version, model)
+        return model
+
+    def reload(self):
+        """Forces the next get_model call to load the served version from disk."""
+        with self._lock:
+            self._current = (None, None)
+
+model_registry = ModelRegistry()
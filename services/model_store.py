@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from uuid import uuid4
+import joblib
+
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "models/versions")
+# Versions kept on disk besides the current one; older ones are deleted after a promotion
+MODEL_VERSIONS_TO_KEEP = int(os.getenv("MODEL_VERSIONS_TO_KEEP", "5"))
+
+ARTIFACT_NAME = "model.joblib"
+METRICS_NAME = "metrics.json"
+CURRENT_POINTER = "CURRENT"
+
+def _write_atomically(path, data):
+    """Writes bytes to a temp file beside `path`, then renames it over `path`."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class ModelStore:
+    """
+    Versioned model artifacts under MODEL_STORE_DIR/<version_id>/.
+    A version is written to a temp directory and renamed into place, and a CURRENT file
+    names the version being served, so readers never see a partially written model.
+    Artifacts are saved uncompressed so they can be loaded with mmap_mode and the
+    numpy arrays of one version are shared by every process that serves it.
+    """
+
+    def __init__(self, store_dir=MODEL_STORE_DIR, versions_to_keep=MODEL_VERSIONS_TO_KEEP):
+        self.store_dir = store_dir
+        self.versions_to_keep = versions_to_keep
+
+    def _version_dir(self, version_id):
+        return os.path.join(self.store_dir, version_id)
+
+    def artifact_path(self, version_id):
+        return os.path.join(self._version_dir(version_id), ARTIFACT_NAME)
+
+    def current_version(self):
+        """Returns the id of the served version, or None if nothing was promoted yet."""
+        try:
+            with open(os.path.join(self.store_dir, CURRENT_POINTER), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, model, metrics=None):
+        """Writes a new version of `model` with its metrics and returns the version id. Doesn't promote it."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        version_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + "-" + uuid4().hex[:8]
+        tmp_dir = tempfile.mkdtemp(dir=self.store_dir, prefix=".tmp-")
+        try:
+            joblib.dump(model, os.path.join(tmp_dir, ARTIFACT_NAME))
+            with open(os.path.join(tmp_dir, METRICS_NAME), "w", encoding="utf-8") as f:
+                json.dump({
+                    "version_id": version_id,
+                    "model_type": type(model).__name__,
+                    "createdAt": datetime.now(timezone.utc).isoformat(),
+                    **(metrics or {})
+                }, f)
+            os.replace(tmp_dir, self._version_dir(version_id))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return version_id
+
+    def promote(self, version_id):
+        """Makes `version_id` the served version and deletes versions beyond MODEL_VERSIONS_TO_KEEP."""
+        # Ids are directory names, never paths
+        if os.path.basename(version_id) != version_id or version_id.startswith(".") \
+                or not os.path.exists(self.artifact_path(version_id)):
+            raise FileNotFoundError(f"Model version {version_id} doesn't exist")
+        _write_atomically(os.path.join(self.store_dir, CURRENT_POINTER), version_id.encode())
+        self.prune()
+
+    def load(self, version_id=None, mmap_mode="r"):
+        """
+        Loads a version, the current one by default. Memory-mapped models are read-only;
+        pass mmap_mode=None for a copy that can keep training.
+        """
+        version_id = version_id or self.current_version()
+        if version_id is None:
+            raise FileNotFoundError("No model version has been promoted")
+        return joblib.load(self.artifact_path(version_id), mmap_mode=mmap_mode)
+
+    def list_versions(self):
+        """Metrics of every stored version, newest first, with the served one flagged."""
+        current = self.current_version()
+        versions = []
+        if not os.path.isdir(self.store_dir):
+            return versions
+        for version_id in sorted(os.listdir(self.store_dir), reverse=True):
+            metrics_path = os.path.join(self._version_dir(version_id), METRICS_NAME)
+            if version_id.startswith(".") or not os.path.exists(metrics_path):
+                continue
+            with open(metrics_path, "r", encoding="utf-8") as f:
+                metrics = json.load(f)
+            versions.append({**metrics, "version_id": version_id, "current": version_id == current})
+        return versions
+
+    def rollback(self, version_id=None):
+        """Promotes `version_id`, or the version saved before the current one. Returns the promoted id."""
+        if version_id is None:
+            version_ids = [version["version_id"] for version in self.list_versions()]
+            current = self.current_version()
+            older = version_ids[version_ids.index(current) + 1:] if current in version_ids else []
+            if not older:
+                raise FileNotFoundError("No earlier model version to roll back to")
+            version_id = older[0]
+        self.promote(version_id)
+        return version_id
+
+    def prune(self):
+        current = self.current_version()
+        version_ids = [version["version_id"] for version in self.list_versions()]
+        for version_id in version_ids[self.versions_to_keep:]:
+            if version_id != current:
+                shutil.rmtree(self._version_dir(version_id), ignore_errors=True)
+
+model_store = ModelStore()
@@ -1,99 +1,254 @@
 import joblib  # Replacing pickle with joblib
 from datetime import datetime, timezone
+from itertools import chain
+import json
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-from fastapi.responses import JSONResponse, Response
-from utils.connection import get_mongo_collection
+from sklearn.linear_model import SGDClassifier
+from utils.connection import get_mongo_collection, CURSOR_BATCH_SIZE
+from utils.vector_codec import decode_vector
+from services.model_registry import model_registry, MODEL_PATH
+from services.model_store import model_store
+from utils.metrics import stage_timer
 import os
 
-local_model_classification_collection = get_mongo_collection("tickets")
-training_logs_collection = get_mongo_collection("training_logs")
-MODEL_PATH = "models/trained_model.pkl"
+METADATA_PATH = "metadata.json"
+# Tickets per partial_fit call; training memory is bounded by this, not by the data size
+TRAINING_BATCH_SIZE = int(os.getenv("TRAINING_BATCH_SIZE", "2048"))
+# Cores used to fit the per-class binary problems; -1 uses every core
+TRAINING_N_JOBS = int(os.getenv("TRAINING_N_JOBS", "-1"))
+SGD_ALPHA = float(os.getenv("SGD_ALPHA", "0.0001"))
+# Tickets are shuffled within a buffer of this many before partial_fit, so one pass over
+# tickets grouped by category doesn't fit them one category at a time
+TRAINING_SHUFFLE_BUFFER = int(os.getenv("TRAINING_SHUFFLE_BUFFER", "20000"))
+# Share of the new tickets held out to measure accuracy, up to TRAINING_HOLDOUT_MAX tickets
+TRAINING_HOLDOUT_FRACTION = float(os.getenv("TRAINING_HOLDOUT_FRACTION", "0.1"))
+TRAINING_HOLDOUT_MAX = int(os.getenv("TRAINING_HOLDOUT_MAX", "5000"))
+TRAINING_RANDOM_STATE = 42
 
-def get_last_training_time():
-    """Fetch the last training timestamp from logs."""
-    last_log = training_logs_collection.find_one({}, {"timestamp": 1}, sort=[("timestamp", -1)])
+TRAINING_PROJECTION = {"vectorized_data": 1, "classification_category": 1, "_id": 0}
+
+class TrainingCancelled(Exception):
+    """Raised from a progress callback to stop training before a new version is saved."""
+
+def get_last_training_time(model_version=None):
+    """
+    Fetch the timestamp of the training that produced `model_version` from logs,
+    or of the latest training for the legacy unversioned model.
+    After a rollback this is the older version's timestamp, so its next training
+    catches up on everything the rolled-back versions had learned.
+    """
+    query = {"model_version": model_version} if model_version else {}
+    last_log = get_mongo_collection("training_logs").find_one(query, {"timestamp": 1}, sort=[("timestamp", -1)])
     return last_log["timestamp"] if last_log else None
 
-def train_model(logger):
-    try:
-        """Train the local model using only new tickets since the last training."""
-        last_training_time = get_last_training_time()
-        llm_collection = get_mongo_collection("classified_tickets")
-
-        # Fetch new tickets since last training
-        if last_training_time is None:
-            llm_labeled_tickets = list(llm_collection.find({}, {"vectorized_data": 1, "classification_category": 1, "_id": 0}))
-            local_model_feedback_tickets = list(local_model_classification_collection.find(
-                {"$expr": {"$ne": ["$createdAt", "$updatedAt"]}},  
-                {"vectorized_data": 1, "classification_category": 1, "_id": 0}
-            ))
-        else:
-            llm_labeled_tickets = list(llm_collection.find(
-                {"updatedAt": {"$gt": last_training_time}}, 
-                {"vectorized_data": 1, "classification_category": 1, "_id": 0}
-            ))
-            local_model_feedback_tickets = list(local_model_classification_collection.find(
-                {
-                    "$and": [
-                        {"$expr": {"$ne": ["$createdAt", "$updatedAt"]}},  
-                        {"updatedAt": {"$gt": last_training_time}}  
-                    ]
-                }, 
-                {"vectorized_data": 1, "classification_category": 1, "_id": 0}
-            ))
-
-        all_local_model_feedback_tickets = llm_labeled_tickets + local_model_feedback_tickets
-        if not all_local_model_feedback_tickets:
-            logger.warning("No new ticket for training")
-            return Response(status_code=204)
-
-        logger.info("Fetched all new tickets for training")
-
-        # ✅ Ensure vectorized data is converted properly to NumPy arrays
-        X = np.array([np.array(ticket["vectorized_data"], dtype=np.float32) for ticket in all_local_model_feedback_tickets])
-        y = np.array([ticket["classification_category"] for ticket in all_local_model_feedback_tickets])
-
-        if os.path.exists(MODEL_PATH):
-            model = joblib.load(MODEL_PATH)  
-            logger.info("Loaded existing model for incremental training.")
-        else:
-            model = RandomForestClassifier(n_estimators=100, random_state=42)  
-            logger.info("No existing model found. Initializing a new one.")
-
-        # Split dataset and train
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        model.fit(X_train, y_train)
-        logger.info("Model training completed")
-
-        # Evaluate accuracy
-        y_pred = model.predict(X_test)
-        model_accuracy = accuracy_score(y_test, y_pred)
-
-        # Save model using joblib
-        joblib.dump(model, MODEL_PATH)  
-        logger.info("Saved trained model successfully")
-
-        # Log training details
-        training_logs_collection.insert_one({
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "num_tickets": len(all_local_model_feedback_tickets),
-            "method": "Local Model",
-            "accuracy": model_accuracy
-        })
-        
-        logger.info("Saved training logs")
-
-        return JSONResponse(
-            status_code=200,
-            content={"message": "Model Trained Successfully", "accuracy": model_accuracy}
-        )
-    
-    except Exception as e:
-        logger.error(f"Error occurred while training model: {str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={"message": "Model Training failed", "error": str(e)}
-        )
+def get_training_classes():
+    """Every category the model can predict: the metadata features plus Others."""
+    with open(METADATA_PATH, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    return np.array(sorted({feature["feature_name"] for feature in metadata} | {"Others"}))
+
+def new_model():
+    # log_loss keeps predict_proba available for confidence scores
+    return SGDClassifier(loss="log_loss", alpha=SGD_ALPHA, random_state=TRAINING_RANDOM_STATE, n_jobs=TRAINING_N_JOBS)
+
+def load_incremental_model(model_version, classes, logger):
+    """
+    Returns a writable copy of the served model if it can keep learning, otherwise None.
+    Models without partial_fit (e.g. the earlier RandomForest) or with an outdated
+    category list have to be retrained from the full history.
+    """
+    if model_version is not None:
+        model = model_store.load(model_version, mmap_mode=None)
+    elif os.path.exists(MODEL_PATH):
+        model = joblib.load(MODEL_PATH)
+    else:
+        logger.info("No existing model found. Initializing a new one.")
+        return None
+    if not hasattr(model, "partial_fit"):
+        logger.info(f"Existing {type(model).__name__} can't be trained incrementally. Retraining from all tickets.")
+        return None
+    if not hasattr(model, "classes_") or set(classes) - set(model.classes_):
+        logger.info("Categories changed since the last training. Retraining from all tickets.")
+        return None
+    logger.info("Loaded existing model for incremental training.")
+    return model
+
+def training_queries(last_training_time):
+    """(collection, filter) pairs selecting tickets labelled after `last_training_time` (all of them when None)."""
+    llm_query = {}
+    feedback_query = {"$expr": {"$ne": ["$createdAt", "$updatedAt"]}}
+    if last_training_time is not None:
+        llm_query = {"updatedAt": {"$gt": last_training_time}}
+        feedback_query = {"$and": [feedback_query, {"updatedAt": {"$gt": last_training_time}}]}
+    return [
+        (get_mongo_collection("classified_tickets"), llm_query),
+        (get_mongo_collection("tickets"), feedback_query)
+    ]
+
+def iter_training_tickets(last_training_time):
+    """Streams labelled tickets updated after `last_training_time` from both collections."""
+    return chain.from_iterable(
+        collection.find(query, TRAINING_PROJECTION, batch_size=CURSOR_BATCH_SIZE)
+        for collection, query in training_queries(last_training_time)
+    )
+
+def count_training_tickets(last_training_time):
+    return sum(collection.count_documents(query) for collection, query in training_queries(last_training_time))
+
+def iter_labelled_tickets(tickets, classes, logger):
+    """Yields the tickets that have a vector and a category the model knows."""
+    known_classes = set(classes)
+    skipped = 0
+    for ticket in tickets:
+        if ticket.get("classification_category") not in known_classes or "vectorized_data" not in ticket:
+            skipped += 1
+            continue
+        yield ticket
+    if skipped:
+        logger.warning(f"Skipped {skipped} tickets without a vector or with a category missing from {METADATA_PATH}")
+
+def split_holdout(tickets, holdout, fraction, max_size, rng):
+    """
+    Yields the tickets to train on and fills `holdout` with a uniform sample of about
+    `fraction` of them, at most `max_size`. Tickets pushed out of the sample are yielded.
+    """
+    candidates = 0
+    for ticket in tickets:
+        if rng.random() >= fraction:
+            yield ticket
+            continue
+        # Reservoir sampling over the candidates keeps the sample uniform across the whole stream
+        candidates += 1
+        if len(holdout) < max_size:
+            holdout.append(ticket)
+            continue
+        slot = int(rng.integers(candidates))
+        if slot < max_size:
+            holdout[slot], ticket = ticket, holdout[slot]
+        yield ticket
+
+def shuffle_buffered(tickets, buffer_size, rng):
+    """Yields the tickets in an order shuffled within a window of `buffer_size` tickets."""
+    buffer = []
+    for ticket in tickets:
+        if len(buffer) < buffer_size:
+            buffer.append(ticket)
+            continue
+        slot = int(rng.integers(buffer_size))
+        buffer[slot], ticket = ticket, buffer[slot]
+        yield ticket
+    rng.shuffle(buffer)
+    yield from buffer
+
+def iter_training_batches(tickets, classes, batch_size):
+    """
+    Fills preallocated float32 arrays from labelled tickets and yields (X, y) views per batch.
+    The arrays are reused, so a batch is only valid until the next one is requested.
+    """
+    X = None
+    y = np.empty(batch_size, dtype=classes.dtype)
+    size = 0
+    for ticket in tickets:
+        category = ticket["classification_category"]
+        vector = decode_vector(ticket["vectorized_data"])
+        if X is None:
+            X = np.empty((batch_size, len(vector)), dtype=np.float32)
+        X[size] = vector
+        y[size] = category
+        size += 1
+        if size == batch_size:
+            yield X, y
+            size = 0
+    if size:
+        yield X[:size], y[:size]
+
+def train_model(logger, on_progress=None, training_job_id=None):
+    """
+    Train the local model incrementally on tickets labelled since the last training.
+    Tickets are streamed in TRAINING_BATCH_SIZE batches into partial_fit, shuffled within a
+    bounded buffer, so time and memory scale with the new data. Accuracy is measured on a sample
+    of the new tickets held out until the rest are fitted; the model then learns from them too.
+    `on_progress(processed, total)` is called after every batch and may raise TrainingCancelled.
+    Returns the training details, or None when there was nothing new to train on.
+    """
+    # Tickets updated while training runs are picked up by the next training
+    started_at = datetime.now(timezone.utc).isoformat()
+    timings = {}
+    classes = get_training_classes()
+    base_version = model_store.current_version()
+    with stage_timer("train_model", "load_model", timings):
+        model = load_incremental_model(base_version, classes, logger)
+    if model is None:
+        model = new_model()
+        base_version = None
+        last_training_time = None
+    else:
+        last_training_time = get_last_training_time(base_version)
+
+    with stage_timer("train_model", "count", timings):
+        total = count_training_tickets(last_training_time) if on_progress else None
+    num_tickets = 0
+    num_evaluated = 0
+    num_correct = 0
+    rng = np.random.default_rng(TRAINING_RANDOM_STATE)
+    holdout = []
+    tickets = iter_labelled_tickets(iter_training_tickets(last_training_time), classes, logger)
+    tickets = split_holdout(tickets, holdout, TRAINING_HOLDOUT_FRACTION, TRAINING_HOLDOUT_MAX, rng)
+    batches = iter_training_batches(shuffle_buffered(tickets, TRAINING_SHUFFLE_BUFFER, rng), classes, TRAINING_BATCH_SIZE)
+    while True:
+        # Reading and decoding a batch from Mongo is timed apart from fitting it
+        with stage_timer("train_model", "mongo_fetch", timings):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        X, y = batch
+        with stage_timer("train_model", "partial_fit", timings):
+            model.partial_fit(X, y, classes=classes)
+        num_tickets += len(y)
+        if on_progress:
+            on_progress(num_tickets, total)
+
+    if hasattr(model, "classes_"):
+        with stage_timer("train_model", "evaluate", timings):
+            for X, y in iter_training_batches(holdout, classes, TRAINING_BATCH_SIZE):
+                num_correct += int(np.count_nonzero(model.predict(X) == y))
+                num_evaluated += len(y)
+    # Held-out tickets aren't picked up by the next training, so the model learns them now
+    for X, y in iter_training_batches(holdout, classes, TRAINING_BATCH_SIZE):
+        with stage_timer("train_model", "partial_fit", timings):
+            model.partial_fit(X, y, classes=classes)
+        num_tickets += len(y)
+        if on_progress:
+            on_progress(num_tickets, total)
+
+    if num_tickets == 0:
+        logger.warning("No new ticket for training")
+        return None
+
+    logger.info(f"Model training completed on {num_tickets} tickets")
+    # None when nothing was held out, or when the held-out tickets were all there was to train on
+    model_accuracy = num_correct / num_evaluated if num_evaluated else None
+
+    training_details = {
+        "timestamp": started_at,
+        "training_job_id": training_job_id,
+        "num_tickets": num_tickets,
+        "method": "Local Model",
+        "incremental": last_training_time is not None,
+        "base_version": base_version,
+        "accuracy": model_accuracy,
+        "timings": timings
+    }
+
+    # Save as a new version and serve it once it is fully written
+    with stage_timer("train_model", "save_model", timings):
+        model_version = model_store.save(model, training_details)
+        model_store.promote(model_version)
+    model_registry.reload()
+    logger.info(f"Saved trained model version {model_version} successfully")
+
+    # Log training details
+    training_details["model_version"] = model_version
+    get_mongo_collection("training_logs").insert_one(dict(training_details))
+    logger.info("Saved training logs")
+    return training_details
@@ -1,14 +1,13 @@
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+from services.similarity_index import similarity_index
 
-def get_most_similar_tickets(vector_embedding, stored_tickets, top_k=5):
+def get_most_similar_tickets(vector_embeddings, top_k=5):
     """
-    Retrieve the most similar past tickets using cosine similarity.
+    Retrieve the most similar past tickets for a batch of embeddings using cosine similarity.
+    Returns, per embedding, a list of (ticket, similarity) pairs with the best match first.
     """
-    embeddings = np.array([ticket["vectorized_data"] for ticket in stored_tickets])
-    similarities = cosine_similarity([vector_embedding], embeddings)[0]
-
-    # Get top-k similar tickets
-    top_indices = similarities.argsort()[-top_k:][::-1]
-    similar_tickets = [(stored_tickets[i], similarities[i]) for i in top_indices]
-    return similar_tickets
\ No newline at end of file
+    indices, similarities = similarity_index.search(vector_embeddings, top_k=top_k)
+    categories = similarity_index.categories_for(indices)
+    return [
+        [({"classification_category": category}, float(similarity)) for category, similarity in zip(row_categories, row_similarities)]
+        for row_categories, row_similarities in zip(categories, similarities)
+    ]
@@ -0,0 +1,294 @@
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from utils.connection import get_mongo_collection
+from utils.vector_codec import decode_vector
+
+INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "models/similarity_index")
+EMBEDDING_DIM = 384
+
+# Collections whose labelled tickets are searchable, in the order they are indexed
+INDEXED_COLLECTIONS = ["classified_tickets", "tickets"]
+
+# Rows fetched from Mongo per round-trip while catching up
+FETCH_BATCH_SIZE = int(os.getenv("SIMILARITY_INDEX_FETCH_BATCH_SIZE", "5000"))
+# Each refresh re-reads documents updated this long before the newest one already indexed,
+# so documents whose updatedAt was set before a concurrent write became visible aren't missed
+WATERMARK_LAG_SECONDS = int(os.getenv("SIMILARITY_INDEX_WATERMARK_LAG", "300"))
+
+# Bumped when the on-disk layout changes; older indexes are rebuilt
+INDEX_VERSION = 2
+# Row key: collection position in INDEXED_COLLECTIONS followed by the 12-byte ObjectId
+KEY_SIZE = 13
+
+# Query and corpus block sizes bound the size of the float32 score matrix held at once:
+# 64 x 65536 is 16 MB per searching process
+QUERY_BLOCK_SIZE = int(os.getenv("SIMILARITY_QUERY_BLOCK_SIZE", "64"))
+CORPUS_BLOCK_SIZE = int(os.getenv("SIMILARITY_CORPUS_BLOCK_SIZE", "65536"))
+
+def normalize_vectors(vectors):
+    """L2-normalises rows of a float32 matrix, leaving zero vectors untouched."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class SimilarityIndex:
+    """
+    Long-lived cosine similarity index over labelled tickets.
+    Vectors are stored L2-normalised in a contiguous float32 file and labels as int32
+    category codes, both memory-mapped so restarts don't have to re-read Mongo.
+    The index catches up incrementally by fetching documents whose updatedAt is at or after
+    the newest one indexed from each collection. Every row records the document it came
+    from, so edited labels and upserted documents overwrite their row instead of adding one.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, dim=EMBEDDING_DIM):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self.labels_path = os.path.join(index_dir, "labels.i32")
+        self.keys_path = os.path.join(index_dir, "keys.bin")
+        self.meta_path = os.path.join(index_dir, "meta.json")
+        self.lock_path = os.path.join(index_dir, "index.lock")
+        self._lock = threading.Lock()
+        self._meta = self._empty_meta()
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        # Row of each indexed document, loaded from the keys file
+        self._rows = {}
+
+    def _empty_meta(self):
+        return {"version": INDEX_VERSION, "count": 0, "dim": self.dim, "categories": [], "watermarks": {}}
+
+    @property
+    def size(self):
+        return self._meta["count"]
+
+    @property
+    def categories(self):
+        return self._meta["categories"]
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return self._empty_meta()
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self.meta_path)
+
+    def _map(self, meta):
+        """Memory-maps the first `count` rows of the on-disk index."""
+        count = meta["count"]
+        if count == 0:
+            vectors = np.empty((0, self.dim), dtype=np.float32)
+            labels = np.empty(0, dtype=np.int32)
+        else:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+            labels = np.memmap(self.labels_path, dtype=np.int32, mode="r", shape=(count,))
+        self._vectors, self._labels, self._meta = vectors, labels, meta
+
+    def _load_rows(self, meta):
+        """Brings the document -> row map up to the rows in `meta`, reading only keys appended since the last call."""
+        count = meta["count"]
+        if len(self._rows) > count:
+            self._rows = {}
+        if len(self._rows) == count:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(len(self._rows) * KEY_SIZE)
+            data = f.read((count - len(self._rows)) * KEY_SIZE)
+        for offset in range(0, len(data), KEY_SIZE):
+            self._rows[data[offset:offset + KEY_SIZE]] = len(self._rows)
+
+    def _label_codes(self, meta, categories):
+        codes = {category: code for code, category in enumerate(meta["categories"])}
+        labels = np.empty(len(categories), dtype=np.int32)
+        for i, category in enumerate(categories):
+            if category not in codes:
+                codes[category] = len(meta["categories"])
+                meta["categories"].append(category)
+            labels[i] = codes[category]
+        return labels
+
+    def _append(self, meta, keys, vectors, categories):
+        """Appends rows to the on-disk index. Rows past `count` left by a crash are overwritten."""
+        labels = self._label_codes(meta, categories)
+        count = meta["count"]
+        for path, rows, itemsize in (
+            (self.vectors_path, normalize_vectors(vectors).tobytes(), 4 * self.dim),
+            (self.labels_path, labels.tobytes(), 4),
+            (self.keys_path, b"".join(keys), KEY_SIZE),
+        ):
+            with open(path, "ab") as f:
+                f.truncate(count * itemsize)
+                f.write(rows)
+                f.flush()
+                os.fsync(f.fileno())
+        for i, key in enumerate(keys):
+            self._rows[key] = count + i
+        meta["count"] = count + len(keys)
+
+    def _overwrite(self, meta, rows, vectors, categories):
+        """
+        Replaces the vector and label of existing rows whose document changed, e.g. after a
+        label was edited. Returns the number of rows that actually changed.
+        """
+        labels = self._label_codes(meta, categories)
+        vectors = normalize_vectors(vectors)
+        rows = np.asarray(rows, dtype=np.int64)
+        count = meta["count"]
+        stored_vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        stored_labels = np.memmap(self.labels_path, dtype=np.int32, mode="r", shape=(count,))
+        # Re-scanned documents are mostly unchanged and need no write
+        changed = (stored_labels[rows] != labels) | np.any(stored_vectors[rows] != vectors, axis=1)
+        del stored_vectors, stored_labels
+        if not changed.any():
+            return 0
+
+        order = np.argsort(rows[changed], kind="stable")
+        rows, vectors, labels = rows[changed][order], vectors[changed][order], labels[changed][order]
+        # Runs of consecutive rows are written with one call
+        runs = np.split(np.arange(len(rows)), np.flatnonzero(np.diff(rows) != 1) + 1)
+        for path, values, itemsize in (
+            (self.vectors_path, vectors, 4 * self.dim),
+            (self.labels_path, labels, 4),
+        ):
+            with open(path, "r+b") as f:
+                for run in runs:
+                    f.seek(int(rows[run[0]]) * itemsize)
+                    f.write(values[run].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return len(rows)
+
+    def refresh(self, logger=None):
+        """
+        Adds tickets saved since the last refresh and updates the rows of tickets changed since.
+        Builds the index from scratch on first run.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._lock, open(self.lock_path, "w") as lock_file:
+            # Other processes may share the index directory
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            meta = self._read_meta()
+            if meta.get("version") != INDEX_VERSION:
+                # Indexes without document keys can't track edits, so they are rebuilt
+                meta = self._empty_meta()
+            self._load_rows(meta)
+            added = updated = 0
+            for collection_name in INDEXED_COLLECTIONS:
+                collection_added, collection_updated = self._catch_up(meta, collection_name)
+                added += collection_added
+                updated += collection_updated
+            self._write_meta(meta)
+            self._map(meta)
+        if logger and (added or updated):
+            logger.info(f"Added {added} and updated {updated} tickets in similarity index ({self.size} total)")
+        return added + updated
+
+    def _catch_up(self, meta, collection_name):
+        collection = get_mongo_collection(collection_name)
+        collection_code = INDEXED_COLLECTIONS.index(collection_name).to_bytes(1, "big")
+        query = {"vectorized_data": {"$exists": True}, "classification_category": {"$exists": True}}
+        watermark = meta["watermarks"].get(collection_name)
+        if watermark:
+            since = datetime.fromisoformat(watermark) - timedelta(seconds=WATERMARK_LAG_SECONDS)
+            query["updatedAt"] = {"$gte": since.isoformat()}
+        cursor = collection.find(
+            query, {"vectorized_data": 1, "classification_category": 1, "updatedAt": 1}
+        ).batch_size(FETCH_BATCH_SIZE)
+
+        added = updated = 0
+        new_keys, new_vectors, new_categories = [], [], []
+        rows, row_vectors, row_categories = [], [], []
+        for document in cursor:
+            key = collection_code + document["_id"].binary
+            vector = decode_vector(document["vectorized_data"])
+            category = str(document["classification_category"])
+            row = self._rows.get(key)
+            if row is None:
+                new_keys.append(key)
+                new_vectors.append(vector)
+                new_categories.append(category)
+            else:
+                rows.append(row)
+                row_vectors.append(vector)
+                row_categories.append(category)
+            updated_at = document.get("updatedAt")
+            if isinstance(updated_at, str) and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            if len(new_keys) == FETCH_BATCH_SIZE:
+                self._append(meta, new_keys, np.stack(new_vectors), new_categories)
+                added += len(new_keys)
+                new_keys, new_vectors, new_categories = [], [], []
+            if len(rows) == FETCH_BATCH_SIZE:
+                updated += self._overwrite(meta, rows, np.stack(row_vectors), row_categories)
+                rows, row_vectors, row_categories = [], [], []
+        if new_keys:
+            self._append(meta, new_keys, np.stack(new_vectors), new_categories)
+            added += len(new_keys)
+        if rows:
+            updated += self._overwrite(meta, rows, np.stack(row_vectors), row_categories)
+        if watermark:
+            meta["watermarks"][collection_name] = watermark
+        return added, updated
+
+    def load(self):
+        """Maps the persisted index without touching Mongo."""
+        if os.path.exists(self.meta_path):
+            with self._lock:
+                self._map(self._read_meta())
+
+    def search(self, query_vectors, top_k=5):
+        """
+        Batched top-k cosine search.
+        Returns (indices, scores) arrays of shape (n_queries, k), best match first.
+        """
+        queries = normalize_vectors(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        vectors = self._vectors
+        count = len(vectors)
+        k = min(top_k, count)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        if k == 0:
+            return indices, scores
+
+        for query_start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            query_block = queries[query_start:query_start + QUERY_BLOCK_SIZE]
+            best_indices = np.empty((len(query_block), 0), dtype=np.int64)
+            best_scores = np.empty((len(query_block), 0), dtype=np.float32)
+
+            for corpus_start in range(0, count, CORPUS_BLOCK_SIZE):
+                block_scores = query_block @ vectors[corpus_start:corpus_start + CORPUS_BLOCK_SIZE].T
+                block_k = min(k, block_scores.shape[1])
+                block_indices = np.argpartition(block_scores, -block_k, axis=1)[:, -block_k:]
+                # Merge this block's candidates with the running top-k
+                candidate_scores = np.concatenate(
+                    [best_scores, np.take_along_axis(block_scores, block_indices, axis=1)], axis=1
+                )
+                candidate_indices = np.concatenate([best_indices, block_indices + corpus_start], axis=1)
+                if candidate_scores.shape[1] > k:
+                    keep = np.argpartition(candidate_scores, -k, axis=1)[:, -k:]
+                    candidate_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+                    candidate_indices = np.take_along_axis(candidate_indices, keep, axis=1)
+                best_scores, best_indices = candidate_scores, candidate_indices
+
+            order = np.argsort(-best_scores, axis=1)
+            scores[query_start:query_start + len(query_block)] = np.take_along_axis(best_scores, order, axis=1)
+            indices[query_start:query_start + len(query_block)] = np.take_along_axis(best_indices, order, axis=1)
+        return indices, scores
+
+    def categories_for(self, indices):
+        """Maps index rows returned by search to their category names."""
+        categories = self._meta["categories"]
+        return [[categories[code] for code in row] for row in self._labels[indices]]
+
+similarity_index = SimilarityIndex()
@@ -1,124 +1,279 @@
-import json
-from fastapi.responses import JSONResponse
-import joblib
-from utils.connection import get_mongo_collection
+import asyncio
+import logging
+import os
+from collections import deque
+from utils.connection import get_async_collection
 import numpy as np
-from utils.embeddings import generate_embedding
+from utils.embeddings import generate_embeddings, embedding_batcher
+from utils.vector_codec import encode_vector
 from services.similar_ticket import get_most_similar_tickets
+from services.model_registry import model_registry
+from services.similarity_index import similarity_index
 from datetime import datetime, timezone
+from services.database import updateJobStatus, updateJobProgress, incrementJobStats, serialize_mongo_document
+from services.job_events import job_event_bus
+from utils.ticket_stream import iter_tickets, iter_file_chunks, iter_ticket_chunks
+from utils.metrics import stage_timer, TICKETS_CLASSIFIED
 
+# Tickets embedded, classified and saved together
+CLASSIFICATION_CHUNK_SIZE = int(os.getenv("CLASSIFICATION_CHUNK_SIZE", "1000"))
+# Nearest-neighbour fast path: a ticket with at least KNN_MIN_NEIGHBOURS past tickets at
+# KNN_SIMILARITY_THRESHOLD similarity or more is labelled by their vote instead of the model.
+# Off by default: tickets it labels are indexed and vote again, so its mistakes reinforce themselves
+KNN_FAST_PATH = os.getenv("KNN_FAST_PATH", "false").lower() == "true"
+KNN_SIMILARITY_THRESHOLD = float(os.getenv("KNN_SIMILARITY_THRESHOLD", "0.9"))
+KNN_MIN_NEIGHBOURS = int(os.getenv("KNN_MIN_NEIGHBOURS", "3"))
+KNN_TOP_K = int(os.getenv("KNN_TOP_K", "5"))
+# Store each job's per-stage time breakdown on its jobs document
+JOB_TIMINGS = os.getenv("JOB_TIMINGS", "true").lower() == "true"
 
-tickets_collection = get_mongo_collection("tickets")
-jobs_collection = get_mongo_collection("jobs")
+# Latest measured model inference time per ticket, used to estimate time saved by the fast path
+model_seconds_per_ticket = None
 
-def fetch_all_classified_tickets_from_db():
+
+def embed_and_classify(texts):
+    """
+    CPU-bound part of classifying a chunk: embedding and model inference.
+    Runs in a bulk classification worker process, which loads its own embedding model.
+    """
+    if KNN_FAST_PATH:
+        # Pick up index rows appended by the process that refreshed it
+        similarity_index.load()
+    timings = {}
+    # Generate vector embeddings for all ticket descriptions in one batch
+    vector_embeddings = generate_embeddings(texts, as_numpy=True, timings=timings)
+    # Classify all tickets with the neighbour vote or the trained model
+    stats = {}
+    return vector_embeddings, classify_ticket_batch(vector_embeddings, stats, timings), stats, timings
+
+def classify_embedded(vector_embeddings, timings):
+    """
+    Model part of embed_and_classify, for chunks embedded in the API process.
+    Runs in a worker thread. Returns (classification results, fast path stats, stage timings).
+    """
+    if KNN_FAST_PATH:
+        similarity_index.load()
+    stats = {}
+    return classify_ticket_batch(vector_embeddings, stats, timings), stats, timings
+
+def build_ticket_documents(job_id, tickets, vector_embeddings, classification_results, logger, document_ids=None):
     """
-    Fetch both LLM-classified and locally-classified tickets with their vector embeddings.
+    Returns the `tickets` documents of a classified chunk, leaving out tickets that failed.
+    `document_ids` gives each ticket's _id when the caller needs idempotent writes.
     """
-    # Fetch LLM-classified tickets
-    llm_collection = get_mongo_collection("classified_tickets")
-    llm_tickets = list(llm_collection.find({}, {"vectorized_data": 1, "classification_category": 1, "_id": 0}))
+    classified_tickets = []
+    if classification_results is None:
+        classification_results = [None] * len(tickets)
+    for i, (ticket, vector_embedding, classification_result) in enumerate(zip(tickets, vector_embeddings, classification_results)):
+        if classification_result:
+            classified_tickets.append({
+                **({"_id": document_ids[i]} if document_ids else {}),
+                "ticket_id": ticket['ticket_id'],
+                "description": ticket['description'],
+                "product": ticket['product'],
+                "created_date": ticket['created_date'],
+                "classification_category": classification_result["predicted_category"],
+                "confidence_score": classification_result["confidence_score"],
+                "vectorized_data": encode_vector(vector_embedding),  
+                "mode_of_tagging": classification_result["mode_of_tagging"],
+                "job_id":job_id,
+                "createdAt":datetime.now(timezone.utc).isoformat(),
+                "updatedAt":datetime.now(timezone.utc).isoformat()
+            })
+        else:
+            logger.debug(f"Failed to classify ticket ID: {ticket['ticket_id']}")
+    if len(classified_tickets) < len(tickets):
+        logger.warning(f"Failed to classify {len(tickets) - len(classified_tickets)} of {len(tickets)} tickets in chunk")
+    return classified_tickets
 
-    # Fetch locally classified tickets
-    local_tickets = list(tickets_collection.find({}, {"vectorized_data": 1, "classification_category": 1, "_id": 0}))
+async def classify_chunk_documents(job_id, tickets, logger):
+    """
+    Embeds and classifies one chunk of tickets without saving it.
+    Returns (ticket documents, fast path stats, stage timings).
+    """
+    texts = [ticket['description']+" in "+ticket['product'] for ticket in tickets]
+    # Chunks are embedded by this process's model, which web workers share copy-on-write after
+    # preload. Encoding and inference run in threads and release the GIL, so the event loop keeps serving
+    timings = {}
+    if embedding_batcher.running:
+        # Encodes run one at a time, and small chunks (e.g. small uploads) are merged with other requests' texts
+        vector_embeddings = await embedding_batcher.embed(texts, timings)
+    else:
+        vector_embeddings = await asyncio.to_thread(generate_embeddings, texts, as_numpy=True, timings=timings)
+    classification_results, stats, timings = await asyncio.to_thread(classify_embedded, vector_embeddings, timings)
+    classified_tickets = build_ticket_documents(job_id, tickets, vector_embeddings, classification_results, logger)
+    return classified_tickets, stats, timings
 
-    # Combine both datasets
-    all_tickets = llm_tickets + local_tickets
-    return all_tickets
+async def save_classified_chunk(job_id, classified_tickets, stats, timings):
+    """Saves the documents of a classified chunk and adds its stats and timings to the job."""
+    # Save classified tickets to MongoDB
+    if classified_tickets:
+        with stage_timer("classify_tickets", "mongo_write", timings):
+            await get_async_collection("tickets").insert_many(classified_tickets)
+        for ticket in classified_tickets:
+            TICKETS_CLASSIFIED.labels(ticket["mode_of_tagging"]).inc()
+    if stats:
+        await incrementJobStats(job_id, stats, timings if JOB_TIMINGS else None)
 
+async def classify_ticket_chunk(job_id, tickets, logger):
+    """
+    Embeds, classifies and saves one chunk of tickets, and adds its fast path stats and
+    stage timings to the job. Returns the saved ticket documents.
+    """
+    classified_tickets, stats, timings = await classify_chunk_documents(job_id, tickets, logger)
+    await save_classified_chunk(job_id, classified_tickets, stats, timings)
+    return classified_tickets
+
+def publish_classified_batch(job_id, classified_tickets, processed, total):
+    """Pushes a saved chunk to the job's subscribers, if any are listening."""
+    if not job_event_bus.has_subscribers(job_id):
+        return
+    batch = []
+    for ticket in classified_tickets:
+        ticket = serialize_mongo_document(ticket)
+        ticket.pop("vectorized_data", None)
+        batch.append(ticket)
+    job_event_bus.publish(job_id, {
+        "type":"batch",
+        "classified_tickets":batch,
+        "progress":{"processed":processed, "total":total}
+    })
 
-async def classify_tickets(job_id, tickets, logger):
+async def classify_ticket_stream(job_id, upload_path, logger, total=None, max_in_flight=1):
+    """
+    Classifies tickets parsed incrementally from a spooled upload.
+    At most `max_in_flight` chunks are classified at once. Chunks are saved and published in input
+    order, so saved _ids increase in the order subscribers receive them and resync from the last one.
+    Progress is recorded on the job after every chunk. The upload is kept if the job is cancelled,
+    so it can be reclaimed after a restart.
+    """
+    pending = deque()
     try:
-        classified_tickets = []
-        stored_tickets = fetch_all_classified_tickets_from_db()
-        for ticket in tickets:
-            # Generate vector embedding for the ticket description
-            vector_embedding = generate_embedding(ticket['description']+" in "+ticket['product'])
-
-            # Classify the ticket using the trained model
-            classification_result = await classify_ticket(vector_embedding, stored_tickets)
-    
-            if classification_result:
-                classified_tickets.append({
-                    "ticket_id": ticket['ticket_id'],
-                    "description": ticket['description'],
-                    "product": ticket['product'],
-                    "created_date": ticket['created_date'],
-                    "classification_category": classification_result["predicted_category"],
-                    "confidence_score": classification_result["confidence_score"],
-                    "vectorized_data": vector_embedding,  
-                    "mode_of_tagging": "local_model",
-                    "job_id":job_id,
-                    "createdAt":datetime.now(timezone.utc).isoformat(),
-                    "updatedAt":datetime.now(timezone.utc).isoformat()
-                })
-            else:
-                print(f"Failed to classify ticket ID: {ticket['ticket_id']}")
+        if KNN_FAST_PATH:
+            # Pick up tickets labelled since the last job
+            await asyncio.to_thread(similarity_index.refresh, logger)
+        chunks = iter_ticket_chunks(iter_tickets(iter_file_chunks(upload_path)), CLASSIFICATION_CHUNK_SIZE)
+        processed_count = 0
+        classified_count = 0
+        exhausted = False
+        while not exhausted or pending:
+            if not exhausted and len(pending) < max_in_flight:
+                # Reading and parsing the file is blocking I/O
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.append((len(chunk), asyncio.ensure_future(classify_chunk_documents(job_id, chunk, logger))))
+                continue
+            chunk_size, task = pending.popleft()
+            classified_tickets, stats, timings = await task
+            await save_classified_chunk(job_id, classified_tickets, stats, timings)
+            classified_count += len(classified_tickets)
+            processed_count += chunk_size
+            await updateJobProgress(job_id, processed_count, total)
+            publish_classified_batch(job_id, classified_tickets, processed_count, total)
+            logger.info(f"Classified {classified_count} tickets for job {job_id}")
+        status = "COMPLETED" if classified_count else "FAILED"
+        await updateJobStatus(job_id, status)
+        job_event_bus.publish(job_id, {"type":"status", "status":status})
         logger.info("Ticket classification completed")
-        # Save classified tickets to MongoDB
-        if classified_tickets!=[]:
-            tickets_collection.insert_many(classified_tickets)
-            jobs_collection.update_one({"job_id":job_id},{"$set":{"Status":"COMPLETED"}})
-            logger.info("Saved tickets in tickets collection after classification")
-            for ticket in classified_tickets:
-                if "_id" in ticket:
-                    ticket["_id"] = str(ticket["_id"])
-            return JSONResponse(
-                status_code=201,
-                content={"message":"Classified ticket successfully", "classified_tickets":classified_tickets}
-            )
-        else:
-            
-            return JSONResponse(
-                status_code="200",
-                content={"message":"No Ticket Classified", "classified_tickets":[]}
-            )
+    except asyncio.CancelledError:
+        for _, task in pending:
+            task.cancel()
+        raise
     except Exception as e:
+        for _, task in pending:
+            task.cancel()
         logger.error("Error occured in ticket classification" + str(e))
-        jobs_collection.update_one({"job_id":job_id},{"$set":{"Status":"FAILED"}})
-        return JSONResponse(
-            status_code=400,
-            content={"message":"Ticket Classification failed", "classified_tickets":[]}
-        )
+        await updateJobStatus(job_id, "FAILED")
+        job_event_bus.publish(job_id, {"type":"status", "status":"FAILED"})
+    if os.path.exists(upload_path):
+        os.remove(upload_path)
 
 
     
 
-async def classify_ticket(vector_embedding, stored_tickets):
-    threshold=0.9
+def vote_by_neighbours(similar_tickets):
+    """
+    Similarity-weighted vote of the neighbours above KNN_SIMILARITY_THRESHOLD.
+    Returns (category, confidence) or None when too few neighbours are that close.
+    """
+    close_tickets = [(ticket, similarity) for ticket, similarity in similar_tickets if similarity >= KNN_SIMILARITY_THRESHOLD]
+    if len(close_tickets) < KNN_MIN_NEIGHBOURS:
+        return None
+    weights = {}
+    for ticket, similarity in close_tickets:
+        category = ticket["classification_category"]
+        weights[category] = weights.get(category, 0.0) + similarity
+    predicted_category = max(weights, key=weights.get)
+    return predicted_category, weights[predicted_category] / sum(weights.values())
+
+def predict_with_model(model, X):
+    if hasattr(model, "predict_proba"):  # Check if model supports probability estimation
+        # Category is the class with the highest probability, so no separate predict pass is needed
+        probabilities = model.predict_proba(X)
+        best_indices = probabilities.argmax(axis=1)
+        predicted_categories = model.classes_[best_indices]
+        confidence_scores = probabilities[np.arange(len(best_indices)), best_indices]
+    else:
+        predicted_categories = model.predict(X)
+        confidence_scores = np.full(len(predicted_categories), 0.95)  # Default confidence if model doesn't support `predict_proba`
+    return predicted_categories, confidence_scores
+
+def classify_ticket_batch(vector_embeddings, stats=None, timings=None):
+    """
+    Classify a batch of ticket embeddings.
+    Tickets with enough close neighbours in the similarity index are labelled by a weighted
+    vote (mode "knn"); the rest go through one predict_proba call (mode "local_model").
+    Fast path counts are added to `stats` and stage durations to `timings` when given.
+    Returns one result per embedding, or None if the batch couldn't be classified.
+    """
+    global model_seconds_per_ticket
     try:
-        with open("models/trained_model.pkl", "rb") as f:
-            model = joblib.load(f)
-
-        # Get predicted category
-        # look for similar tickets first
-        similar_tickets = get_most_similar_tickets(vector_embedding, stored_tickets)
-        high_confidence_tickets = [t[0] for t in similar_tickets if t[1] >= threshold]
-        # if similar tickets are found, return most similar ticket's category and cofidence score
-        # if high_confidence_tickets:
-        #     # Majority vote from similar tickets
-        #     categories = [ticket["classification_category"] for ticket in high_confidence_tickets]
-        #     predicted_category= max(set(categories), key=categories.count)
-        #     confidence_score = categories.count(predicted_category) / len(categories)
-
-        # use locally trained model
-        predicted_category = model.predict([vector_embedding])[0]
-
-        # Get confidence score using probability prediction
-        if hasattr(model, "predict_proba"):  # Check if model supports probability estimation
-            probabilities = model.predict_proba([vector_embedding])
-            confidence_score = round(max(probabilities[0]), 4)  # Highest probability
-        else:
-            confidence_score = 0.95  # Default confidence if model doesn't support `predict_proba`
+        results = [None] * len(vector_embeddings)
+        batch_timings = {}
+        if KNN_FAST_PATH and similarity_index.size:
+            with stage_timer("classify_tickets", "similarity_search", batch_timings):
+                for i, similar_tickets in enumerate(get_most_similar_tickets(vector_embeddings, top_k=KNN_TOP_K)):
+                    vote = vote_by_neighbours(similar_tickets)
+                    if vote:
+                        results[i] = {
+                            "predicted_category": str(vote[0]),
+                            "confidence_score": round(float(vote[1]), 4),
+                            "mode_of_tagging": "knn"
+                        }
+        knn_seconds = batch_timings.get("similarity_search", 0.0)
 
+        # use locally trained model for the tickets the neighbours didn't settle
+        remaining = [i for i, result in enumerate(results) if result is None]
+        model_seconds = 0.0
+        if remaining:
+            model = model_registry.get_model()
+            with stage_timer("classify_tickets", "model_inference", batch_timings):
+                X = np.asarray(vector_embeddings, dtype=np.float32)[remaining]
+                predicted_categories, confidence_scores = predict_with_model(model, X)
+            model_seconds = batch_timings["model_inference"]
+            model_seconds_per_ticket = model_seconds / len(remaining)
+            for i, predicted_category, confidence_score in zip(remaining, predicted_categories, confidence_scores):
+                results[i] = {
+                    "predicted_category": str(predicted_category),
+                    "confidence_score": round(float(confidence_score), 4),
+                    "mode_of_tagging": "local_model"
+                }
 
-        return {
-            "predicted_category": predicted_category,
-            "confidence_score": confidence_score
-        }
+        if stats is not None:
+            knn_tickets = len(results) - len(remaining)
+            stats["knn_tickets"] = stats.get("knn_tickets", 0) + knn_tickets
+            stats["model_tickets"] = stats.get("model_tickets", 0) + len(remaining)
+            stats["knn_seconds"] = stats.get("knn_seconds", 0.0) + knn_seconds
+            stats["model_seconds"] = stats.get("model_seconds", 0.0) + model_seconds
+            # Inference the fast path skipped, at the latest measured per-ticket model cost
+            stats["estimated_seconds_saved"] = stats.get("estimated_seconds_saved", 0.0) + knn_tickets * (model_seconds_per_ticket or 0.0)
+        if timings is not None:
+            for stage, seconds in batch_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return results
 
     except Exception as e:
-        print(f"Error in classification: {e}")
+        logging.getLogger("app_logger").error(f"Error in classification: {e}")
         return None
-
-
@@ -1,33 +1,40 @@
-from openai import OpenAI
 from datetime import datetime, timezone
 import json
-from services.database import get_mongo_collection
-from utils.clustering import cluster_tickets
-from utils.embeddings import generate_embedding  # Assuming this function generates vector embeddings
+import asyncio
+import hashlib
+from utils.connection import get_async_collection
+from utils.bulk_writer import AsyncBulkWriter
+from pymongo import InsertOne
+from utils.clustering import cluster_tickets, ticket_text
+from utils.vector_codec import encode_vector
+from utils.llm_client import complete
+from utils.metrics import stage_timer
 from fastapi.responses import JSONResponse
 import os
 
 # Load config
-api_key = os.getenv("API_KEY", "")  
+METADATA_PATH = "metadata.json"
+# Cluster representatives classified per prompt; 1 sends one prompt per cluster
+LLM_LABEL_BATCH_SIZE = int(os.getenv("LLM_LABEL_BATCH_SIZE", "1"))
 
+metadata_cache = {}
 
-async def train_with_chatgpt(tickets, logger):
-    
-    try:
-        logger.info("labelling of tickets by llm model started")
-        tickets = [ticket.dict() for ticket in tickets]
-        clustered_tickets = await cluster_tickets(tickets, logger)
-        responses = []
-        
-        with open("metadata.json", "r", encoding="utf-8") as f:
+def load_metadata():
+    """Returns the prompt-ready metadata string and its version, read once per file change."""
+    mtime = os.path.getmtime(METADATA_PATH)
+    if metadata_cache.get("mtime") != mtime:
+        with open(METADATA_PATH, "r", encoding="utf-8") as f:
             metadata = json.load(f)
-        # Step 2: Process each cluster
-        for cluster in clustered_tickets:
-            representative_ticket = cluster[0]  # Pick one ticket from cluster
-            ticket_text = representative_ticket['description'] + " in " + representative_ticket['product']
-            metadata_string = json.dumps(metadata, indent=2)
-            # Step 3: Call ChatGPT API for classification
-            prompt = f"""
+        metadata_string = json.dumps(metadata, indent=2)
+        metadata_cache.update({
+            "mtime": mtime,
+            "metadata_string": metadata_string,
+            "version": hashlib.sha256(metadata_string.encode()).hexdigest()[:16]
+        })
+    return metadata_cache["metadata_string"], metadata_cache["version"]
+
+def build_prompt(ticket_text, metadata_string):
+    return f"""
         You are a support ticket classification expert. Your job is to analyze customer complaints and tag those tickets to the feature mentioned in below json metadata of feature and related potential issue that can occur. Ticket description is entered by human, so spelling mistake can happen.
         For the given ticket description, return:
         1. The most accurate **category** for classification by reading metadata pasted below.
@@ -44,47 +51,107 @@ async def train_with_chatgpt(tickets, logger):
         Ticket Description:
         "{ticket_text}"
         """
+
+def build_batch_prompt(ticket_texts, metadata_string):
+    numbered_tickets = "\n".join(f'{i}. "{ticket_text}"' for i, ticket_text in enumerate(ticket_texts, start=1))
+    return f"""
+        You are a support ticket classification expert. Your job is to analyze customer complaints and tag those tickets to the feature mentioned in below json metadata of feature and related potential issue that can occur. Ticket descriptions are entered by humans, so spelling mistakes can happen.
+        For each numbered ticket description below, return:
+        1. The most accurate **category** for classification by reading metadata pasted below.
+        2. A **confidence score** between 0 to 1 (e.g., 0.85 for 85% confidence), give confidence score based on your confidence, not just some random number.
+        This is the metadata of feature and description of potential issue that user can face while using product. Metadata: {metadata_string}
+        Please return the response in strict JSON format, with one entry per ticket:
+        {{
+            "classifications": [
+                {{"ticket": 1, "category": "Best category name", "confidence_score": 0.0 to 1.0}}
+            ]
+        }}
+
+        If a ticket doesn't seem to belong to any of pre-defined category, tag it as Others, with low confidence score.
+
+        Ticket Descriptions:
+        {numbered_tickets}
+        """
+
+async def label_ticket_texts(ticket_texts, logger, batch_size=LLM_LABEL_BATCH_SIZE, use_cache=True):
+    """
+    Classifies ticket texts with the LLM. Prompts are sent concurrently (bounded by LLM_CONCURRENCY)
+    and replies are cached per prompt and metadata version.
+    Returns one {"category", "confidence_score"} dict per text.
+    """
+    metadata_string, metadata_version = load_metadata()
+    if batch_size <= 1:
+        return await asyncio.gather(*(
+            complete(build_prompt(ticket_text, metadata_string), metadata_version, parse=json.loads, use_cache=use_cache)
+            for ticket_text in ticket_texts
+        ))
+
+    batches = [ticket_texts[i:i + batch_size] for i in range(0, len(ticket_texts), batch_size)]
+    responses = await asyncio.gather(*(
+        complete(build_batch_prompt(batch, metadata_string), metadata_version, parse=json.loads, use_cache=use_cache)
+        for batch in batches
+    ))
+    labels = []
+    for batch, response_data in zip(batches, responses):
+        by_ticket = {entry.get("ticket"): entry for entry in response_data.get("classifications", [])}
+        if len(by_ticket) != len(batch):
+            logger.warning(f"LLM returned {len(by_ticket)} classifications for a batch of {len(batch)} tickets")
+        labels.extend(by_ticket.get(i, {}) for i in range(1, len(batch) + 1))
+    return labels
+
+
+async def train_with_chatgpt(tickets, logger):
+    
+    try:
+        logger.info("labelling of tickets by llm model started")
+        tickets = [ticket.dict() for ticket in tickets]
+        # Clustering embeds every ticket once; the same vectors are saved with the labels
+        with stage_timer("train_with_chatgpt", "clustering"):
+            clustered_tickets, vectorized_tickets = await cluster_tickets(tickets, logger)
+        for ticket, vectorized_data in zip(tickets, vectorized_tickets):
+            # Plain lists keep the response JSON serializable
+            ticket["vectorized_data"] = vectorized_data.tolist()
+        responses = []
+        
+        # Classified tickets are buffered and written in bulk
+        writer = AsyncBulkWriter(get_async_collection("classified_tickets"))
+        # Step 2: Pick one ticket from each cluster as its representative
+        representative_texts = [ticket_text(cluster[0]) for cluster in clustered_tickets]
+        # Step 3: Call ChatGPT API for classification of all representatives concurrently
+        with stage_timer("train_with_chatgpt", "llm_labelling"):
+            labels = await label_ticket_texts(representative_texts, logger)
+        # Step 4 and 5 are timed together as the bulk writer flushes while tickets are added
+        with stage_timer("train_with_chatgpt", "mongo_write"):
+            for cluster, label in zip(clustered_tickets, labels):
+                classified_category = label.get("category", "Unknown")
+                confidence_score = label.get("confidence_score", 0.0)
             
-            client = OpenAI(
-                api_key=api_key,  # This is the default and can be omitted
-            )
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="gpt-4"
-            )
-            response_data = json.loads(response.choices[0].message.content)
-            classified_category = response_data.get("category", "Unknown")
-            confidence_score = response_data.get("confidence_score", 0.0)
-            
-            # Step 4: Assign classification to all tickets in the cluster
-            for ticket in cluster:
-                text = ticket['description']+" in " + ticket['product']
-                vectorized_data = generate_embedding(text)  # Generate vector embeddings
+                # Step 4: Assign classification to all tickets in the cluster
+                for ticket in cluster:
+                    vectorized_data = ticket["vectorized_data"]
 
-                ticket["classified_category"] = classified_category
-                ticket["confidence_score"] = confidence_score  # Assuming ChatGPT confidence
-                ticket["mode_of_tagging"] = "chatgpt"
-                ticket["vectorized_data"] = vectorized_data
+                    ticket["classified_category"] = classified_category
+                    ticket["confidence_score"] = confidence_score  # Assuming ChatGPT confidence
+                    ticket["mode_of_tagging"] = "chatgpt"
 
-                # Step 5: Save to MongoDB
-                collection = get_mongo_collection("classified_tickets")
-                
-                collection.insert_one(
-                    {
-                        "ticket_id":ticket['ticket_id'],
-                        "ticket_description":ticket['description'],
-                        "product":ticket['product'],
-                        "created_date": ticket["created_date"],
-                        "classification_category": classified_category,
-                        "confidence_score":confidence_score,
-                        "mode_of_tagging":"chatgpt",
-                        "vectorized_data":vectorized_data,
-                        "createdAt":datetime.now(timezone.utc).isoformat(),
-                        "updatedAt":datetime.now(timezone.utc).isoformat()
-                    }
-                )
+                    # Step 5: Save to MongoDB
+                    await writer.add(InsertOne(
+                        {
+                            "ticket_id":ticket['ticket_id'],
+                            "ticket_description":ticket['description'],
+                            "product":ticket['product'],
+                            "created_date": ticket["created_date"],
+                            "classification_category": classified_category,
+                            "confidence_score":confidence_score,
+                            "mode_of_tagging":"chatgpt",
+                            "vectorized_data":encode_vector(vectorized_data),
+                            "createdAt":datetime.now(timezone.utc).isoformat(),
+                            "updatedAt":datetime.now(timezone.utc).isoformat()
+                        }
+                    ))
             
-            responses.extend(cluster)
+                responses.extend(cluster)
+            await writer.flush()
         logger.info("Ticket Classification done and saved in classified_ticket collection")
         return JSONResponse(
             status_code=201,
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
+from services.database import createTrainingJob, failStaleTrainingJobs, finishTrainingJob, getTrainingJob, getActiveTrainingJob, cancelTrainingJob
+from utils.connection import get_mongo_collection
+
+# The training process refreshes its job this often, and checks whether it was cancelled
+TRAINING_HEARTBEAT_INTERVAL = int(os.getenv("TRAINING_HEARTBEAT_INTERVAL", "10"))
+# Training jobs that stop heartbeating for this long are marked FAILED
+TRAINING_JOB_TIMEOUT = int(os.getenv("TRAINING_JOB_TIMEOUT", "120"))
+
+class TrainingJobActive(Exception):
+    """Raised when a training job is submitted while another one is queued or running."""
+
+    def __init__(self, job_id):
+        super().__init__(f"Training job {job_id} is already running")
+        self.job_id = job_id
+
+def _heartbeat(training_jobs, job_id, cancelled, stopped):
+    while not stopped.wait(TRAINING_HEARTBEAT_INTERVAL):
+        job = training_jobs.find_one_and_update(
+            {"job_id":job_id},
+            {"$set":{"heartbeatAt":datetime.now(timezone.utc).isoformat()}},
+            {"cancelRequested":1}
+        )
+        if job and job.get("cancelRequested"):
+            cancelled.set()
+
+def run_training_job(job_id, request_id):
+    """Entry point of the training process. Records the outcome on the training job."""
+    import logging_config  # Configures app_logger handlers in this process
+    from services.model_training import train_model, TrainingCancelled
+
+    logger = logging.LoggerAdapter(logging.getLogger("app_logger"), {"request_id": request_id, "job_id": job_id})
+    training_jobs = get_mongo_collection("training_jobs")
+    now = datetime.now(timezone.utc).isoformat()
+    job = training_jobs.find_one_and_update(
+        {"job_id":job_id},
+        {"$set":{"Status":"RUNNING", "pid":os.getpid(), "startedAt":now, "updatedAt":now, "heartbeatAt":now}},
+        {"cancelRequested":1}
+    )
+    cancelled = threading.Event()
+    stopped = threading.Event()
+    if job and job.get("cancelRequested"):
+        cancelled.set()
+    heartbeat = threading.Thread(target=_heartbeat, args=(training_jobs, job_id, cancelled, stopped), daemon=True)
+    heartbeat.start()
+
+    def on_progress(processed, total):
+        if cancelled.is_set():
+            raise TrainingCancelled()
+        training_jobs.update_one(
+            {"job_id":job_id},
+            {"$set":{"progress":{"processed":processed, "total":total}, "updatedAt":datetime.now(timezone.utc).isoformat()}}
+        )
+
+    try:
+        if cancelled.is_set():
+            raise TrainingCancelled()
+        result = train_model(logger, on_progress=on_progress, training_job_id=job_id)
+        if result is None:
+            finish_training_job(training_jobs, job_id, "NO_NEW_TICKETS")
+        else:
+            finish_training_job(training_jobs, job_id, "COMPLETED", {
+                "model_version":result["model_version"],
+                "accuracy":result["accuracy"],
+                "num_tickets":result["num_tickets"],
+                "timings":result["timings"]
+            })
+    except TrainingCancelled:
+        logger.info(f"Training job {job_id} cancelled")
+        finish_training_job(training_jobs, job_id, "CANCELLED")
+    except Exception as e:
+        logger.error(f"Error occurred while training model: {str(e)}")
+        finish_training_job(training_jobs, job_id, "FAILED", {"error":str(e)})
+    finally:
+        stopped.set()
+
+def finish_training_job(training_jobs, job_id, status, result=None):
+    training_jobs.update_one(
+        {"job_id":job_id},
+        {
+            "$set":{"Status":status, "result":result, "updatedAt":datetime.now(timezone.utc).isoformat()},
+            "$unset":{"active":""}
+        }
+    )
+
+class TrainingJobRunner:
+    """
+    Runs /train_model requests as training jobs in their own spawned process, so fitting
+    never blocks the event loop. Jobs are recorded in the `training_jobs` collection;
+    at most one is queued or running across all API processes.
+    """
+
+    def __init__(self):
+        self.processes = {}
+
+    def _stale_before(self):
+        return (datetime.now(timezone.utc) - timedelta(seconds=TRAINING_JOB_TIMEOUT)).isoformat()
+
+    async def submit(self, logger):
+        """Starts a training job and returns its id. Raises TrainingJobActive if one is in progress."""
+        await failStaleTrainingJobs(self._stale_before())
+        try:
+            job_id = await createTrainingJob(logger)
+        except DuplicateKeyError:
+            job = await getActiveTrainingJob()
+            raise TrainingJobActive(job["job_id"] if job else "unknown")
+
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_training_job, args=(job_id, logger.extra["request_id"]), name=f"training-{job_id}"
+        )
+        process.start()
+        self.processes[job_id] = process
+        asyncio.create_task(self._reap(job_id, process, logger))
+        return job_id
+
+    async def _reap(self, job_id, process, logger):
+        await asyncio.to_thread(process.join)
+        self.processes.pop(job_id, None)
+        if process.exitcode != 0:
+            # The process died without recording an outcome (e.g. killed for memory)
+            logger.error(f"Training process for job {job_id} exited with code {process.exitcode}")
+            await finishTrainingJob(job_id, "FAILED", {"error":f"Training process exited with code {process.exitcode}"})
+
+    async def status(self, job_id):
+        """Returns the training job, or None if there's no such job."""
+        await failStaleTrainingJobs(self._stale_before())
+        return await getTrainingJob(job_id)
+
+    async def cancel(self, job_id):
+        """
+        Asks a queued or running job to stop; the training process stops before saving a model.
+        Returns False if the job doesn't exist or has already finished.
+        """
+        return await cancelTrainingJob(job_id)
+
+    def stop(self):
+        # Jobs stopped with the server are failed once their heartbeat goes stale
+        for process in self.processes.values():
+            process.terminate()
+
+training_job_runner = TrainingJobRunner()
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from services.model_registry import model_registry
+from services.similarity_index import similarity_index
+from services.ticket_classification import KNN_FAST_PATH
+from utils import connection
+from utils.embeddings import get_embedding_model
+
+class WarmUpState:
+    """Progress of the startup warm-up, reported by /ready."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False
+        self.steps = {}
+        self.error = None
+
+    def mark(self, step, seconds):
+        with self.lock:
+            self.steps[step] = round(seconds, 3)
+
+    def snapshot(self):
+        with self.lock:
+            return {"ready": self.ready, "steps": dict(self.steps), "error": self.error}
+
+warm_up_state = WarmUpState()
+
+def preload_models(logger=None):
+    """
+    Loads the transformer weights and the served classifier without running them.
+    Safe to call before forking workers: nothing here starts threads or opens connections.
+    """
+    logger = logger or logging.getLogger("app_logger")
+    start = time.perf_counter()
+    get_embedding_model()
+    warm_up_state.mark("embedding_model", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        model_registry.get_model()
+    except FileNotFoundError:
+        logger.warning("No trained model to preload, classification needs a /train_model run first")
+    warm_up_state.mark("classifier", time.perf_counter() - start)
+
+def warm_up(logger):
+    """
+    Preloads the models, runs one encode so the first request doesn't pay for it, and checks Mongo.
+    With the kNN fast path on, it also catches the similarity index up with tickets stored since it was saved.
+    """
+    try:
+        preload_models(logger)
+
+        start = time.perf_counter()
+        get_embedding_model().encode(["warm up in Gen TDS"], convert_to_numpy=True)
+        warm_up_state.mark("first_encode", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        connection.ping()
+        warm_up_state.mark("mongo", time.perf_counter() - start)
+
+        if KNN_FAST_PATH:
+            start = time.perf_counter()
+            similarity_index.load()
+            similarity_index.refresh(logger)
+            warm_up_state.mark("similarity_index", time.perf_counter() - start)
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        with warm_up_state.lock:
+            warm_up_state.error = str(e)
+        return
+    with warm_up_state.lock:
+        warm_up_state.ready = True
+    logger.info(f"Warm-up completed: {warm_up_state.snapshot()['steps']}")
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+import utils.bulk_writer as bulk_writer
+from utils.bulk_writer import AsyncBulkWriter, BulkWriter
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bulk_writer, "BULK_WRITE_RETRY_BACKOFF", 0)
+
+def inserted(count):
+    return SimpleNamespace(inserted_count=count, matched_count=0, modified_count=0, upserted_count=0)
+
+class ScriptedCollection:
+    """Answers each bulk_write with the next scripted outcome and records what was sent."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def bulk_write(self, operations, ordered):
+        self.calls.append(list(operations))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class AsyncScriptedCollection(ScriptedCollection):
+    async def bulk_write(self, operations, ordered):
+        return super().bulk_write(operations, ordered)
+
+def operations(count):
+    return [InsertOne({"_id": i}) for i in range(count)]
+
+def test_retries_after_auto_reconnect():
+    collection = ScriptedCollection(AutoReconnect("primary stepped down"), inserted(3))
+    writer = BulkWriter(collection)
+    for operation in operations(3):
+        writer.add(operation)
+    summary = writer.flush()
+    assert len(collection.calls) == 2
+    assert summary["inserted"] == 3 and summary["errors"] == []
+
+def test_auto_reconnect_on_every_attempt_is_raised():
+    collection = ScriptedCollection(*[AutoReconnect("down")] * 2)
+    writer = BulkWriter(collection, max_retries=1)
+    writer.add(operations(1)[0])
+    with pytest.raises(AutoReconnect):
+        writer.flush()
+
+def test_only_transiently_failed_operations_are_retried():
+    ops = operations(3)
+    partial_failure = BulkWriteError({"nInserted": 2, "writeErrors": [{"index": 1, "code": 91, "errmsg": "shutting down"}]})
+    collection = ScriptedCollection(partial_failure, inserted(1))
+    writer = BulkWriter(collection)
+    for operation in ops:
+        writer.add(operation)
+    summary = writer.flush()
+    assert collection.calls[1] == [ops[1]]
+    assert summary["inserted"] == 3 and summary["errors"] == []
+
+def test_permanent_errors_are_raised_with_the_summary():
+    failure = BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}]})
+    writer = BulkWriter(ScriptedCollection(failure))
+    for operation in operations(2):
+        writer.add(operation)
+    with pytest.raises(BulkWriteError) as error:
+        writer.flush()
+    assert error.value.details["batchSummary"]["inserted"] == 1
+    assert [e["code"] for e in error.value.details["writeErrors"]] == [11000]
+
+def test_write_concern_errors_are_reported():
+    failure = BulkWriteError({"nInserted": 2, "writeErrors": [], "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}]})
+    collection = ScriptedCollection(failure)
+    writer = BulkWriter(collection)
+    for operation in operations(2):
+        writer.add(operation)
+    with pytest.raises(BulkWriteError) as error:
+        writer.flush()
+    assert len(collection.calls) == 1
+    assert error.value.details["writeConcernErrors"][0]["code"] == 64
+    assert writer.results[-1]["write_concern_errors"] and writer.results[-1]["inserted"] == 2
+
+def test_async_writer_retries_transient_errors():
+    ops = operations(2)
+    partial_failure = BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 0, "code": 189, "errmsg": "primary stepped down"}]})
+    collection = AsyncScriptedCollection(AutoReconnect("down"), partial_failure, inserted(1))
+
+    async def main():
+        async with AsyncBulkWriter(collection) as writer:
+            for operation in ops:
+                await writer.add(operation)
+        return writer.results
+
+    results = asyncio.run(main())
+    assert collection.calls == [ops, ops, [ops[0]]]
+    assert results[-1]["inserted"] == 2 and results[-1]["errors"] == []
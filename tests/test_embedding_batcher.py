@@ -0,0 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.embedding_batcher import EmbeddingBatcher
+
+def encode(texts, timings):
+    return np.zeros((len(texts), 4), dtype=np.float32)
+
+def test_blocking_callers_filling_the_default_executor_do_not_deadlock():
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+        batcher = EmbeddingBatcher(encode, max_wait_ms=1)
+        await batcher.start()
+        try:
+            # Every default executor thread blocks on a batch, as with to_thread(generate_embeddings)
+            calls = [asyncio.to_thread(batcher.embed_from_thread, [f"text {i}"]) for i in range(6)]
+            results = await asyncio.wait_for(asyncio.gather(*calls), timeout=5)
+        finally:
+            await batcher.stop()
+        return results
+
+    results = asyncio.run(main())
+    assert [vectors.shape for vectors in results] == [(1, 4)] * 6
+
+def test_each_caller_gets_its_own_rows():
+    def encode_lengths(texts, timings):
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+    async def main():
+        batcher = EmbeddingBatcher(encode_lengths, max_wait_ms=20)
+        await batcher.start()
+        try:
+            return await asyncio.gather(batcher.embed(["a", "bb"]), batcher.embed(["ccc"]))
+        finally:
+            await batcher.stop()
+
+    first, second = asyncio.run(main())
+    assert first.ravel().tolist() == [1, 2]
+    assert second.ravel().tolist() == [3]
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+import mongomock
+import numpy as np
+import pytest
+from bson import ObjectId
+import services.similar_ticket as similar_ticket
+import services.similarity_index as similarity_index_module
+from services.similarity_index import SimilarityIndex
+from services.similar_ticket import get_most_similar_tickets
+from services.ticket_classification import vote_by_neighbours
+from utils.vector_codec import encode_vector
+
+DIM = 8
+
+def timestamp(seconds):
+    return (datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+def near(base, seed):
+    rng = np.random.default_rng(seed)
+    return base + rng.normal(scale=0.01, size=DIM).astype(np.float32)
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(similarity_index_module, "get_mongo_collection", lambda name: database[name])
+    return database
+
+@pytest.fixture
+def index(db, tmp_path, monkeypatch):
+    index = SimilarityIndex(str(tmp_path), dim=DIM)
+    monkeypatch.setattr(similar_ticket, "similarity_index", index)
+    return index
+
+def insert_ticket(db, vector, category, updated_at, _id=None):
+    document = {"vectorized_data": encode_vector(vector), "classification_category": category, "updatedAt": updated_at}
+    if _id is not None:
+        document["_id"] = _id
+    return db["tickets"].insert_one(document).inserted_id
+
+def knn_vote(query):
+    return vote_by_neighbours(get_most_similar_tickets(query[np.newaxis], top_k=5)[0])
+
+def test_edited_labels_change_the_knn_vote(db, index):
+    base = np.ones(DIM, dtype=np.float32)
+    ids = [insert_ticket(db, near(base, seed), "Billing", timestamp(seed)) for seed in range(4)]
+    index.refresh()
+    assert knn_vote(base)[0] == "Billing"
+
+    # Relabelled the way /save_edit does it
+    for _id in ids[:3]:
+        db["tickets"].update_one(
+            {"_id": _id}, {"$set": {"classification_category": "Login", "updatedAt": timestamp(3600)}}
+        )
+    index.refresh()
+    assert index.size == 4
+    assert knn_vote(base)[0] == "Login"
+
+def test_refresh_indexes_tickets_with_older_ids(db, index):
+    base = np.ones(DIM, dtype=np.float32)
+    early_id = ObjectId.from_datetime(datetime(2020, 1, 1, tzinfo=timezone.utc))
+    insert_ticket(db, near(base, 0), "Billing", timestamp(0))
+    index.refresh()
+
+    # e.g. a resumed backfill, whose ids carry the job's creation time
+    insert_ticket(db, near(base, 1), "Billing", timestamp(60), _id=early_id)
+    index.refresh()
+    assert index.size == 2
+
+def test_edits_indexed_by_another_process_are_seen_after_load(db, index, tmp_path):
+    base = np.ones(DIM, dtype=np.float32)
+    ticket_id = insert_ticket(db, near(base, 0), "Billing", timestamp(0))
+    index.refresh()
+
+    other = SimilarityIndex(str(tmp_path), dim=DIM)
+    db["tickets"].update_one({"_id": ticket_id}, {"$set": {"classification_category": "Login", "updatedAt": timestamp(60)}})
+    other.refresh()
+    assert other.size == 1
+    index.load()
+    assert index.categories_for(index.search(base, top_k=1)[0]) == [["Login"]]
+
+def test_refresh_without_changes_rewrites_nothing(db, index):
+    base = np.ones(DIM, dtype=np.float32)
+    ids = [insert_ticket(db, near(base, seed), "Billing", timestamp(seed)) for seed in range(4)]
+    assert index.refresh() == 4
+
+    # Every ticket is within the watermark lag, so all of them are fetched again
+    assert index.refresh() == 0
+    db["tickets"].update_one({"_id": ids[2]}, {"$set": {"classification_category": "Login", "updatedAt": timestamp(60)}})
+    assert index.refresh() == 1
+    assert index.size == 4
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import time
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
+
+BULK_WRITE_MAX_OPERATIONS = int(os.getenv("BULK_WRITE_MAX_OPERATIONS", "1000"))
+BULK_WRITE_MAX_DELAY = float(os.getenv("BULK_WRITE_MAX_DELAY", "1.0"))
+BULK_WRITE_MAX_RETRIES = int(os.getenv("BULK_WRITE_MAX_RETRIES", "3"))
+BULK_WRITE_RETRY_BACKOFF = 0.5
+
+# Server error codes worth retrying (network, failover and interruption errors)
+TRANSIENT_ERROR_CODES = {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+DUPLICATE_KEY_ERROR = 11000
+
+class BulkWriterBase:
+    """
+    Shared buffering and retry bookkeeping of the bulk writers.
+    Operations are buffered until `max_operations` are queued or the oldest buffered
+    operation is `max_delay` seconds old, then sent as one unordered bulk_write.
+    There is no timer: the age is checked when an operation is added, so an idle buffer
+    is written by the next add, an explicit flush or the end of the writer's context.
+    """
+
+    def __init__(self, collection, max_operations=BULK_WRITE_MAX_OPERATIONS,
+                 max_delay=BULK_WRITE_MAX_DELAY, max_retries=BULK_WRITE_MAX_RETRIES):
+        self.collection = collection
+        self.max_operations = max_operations
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.operations = []
+        self.first_buffered_at = None
+        self._attempt = 0
+        # One summary per flushed batch
+        self.results = []
+
+    def _buffer(self, operation):
+        if not self.operations:
+            self.first_buffered_at = time.monotonic()
+        self.operations.append(operation)
+        return (
+            len(self.operations) >= self.max_operations
+            or time.monotonic() - self.first_buffered_at >= self.max_delay
+        )
+
+    def _take_batch(self):
+        operations, self.operations = self.operations, []
+        self.first_buffered_at = None
+        # Outcomes of the attempts of the batch being flushed
+        self._partials, self._errors, self._write_concern_errors = [], [], []
+        return operations
+
+    def _retryable_operations(self, operations, error):
+        """
+        Splits a BulkWriteError into operations to retry and errors to report.
+        A duplicate key on a retried insert means the first attempt was applied.
+        """
+        retry, errors = [], []
+        for write_error in error.details.get("writeErrors", []):
+            if write_error["code"] in TRANSIENT_ERROR_CODES:
+                retry.append(operations[write_error["index"]])
+            elif not (write_error["code"] == DUPLICATE_KEY_ERROR and self._attempt > 0):
+                errors.append(write_error)
+        return retry, errors
+
+    def _record(self, pending, outcome):
+        """Records a bulk_write result or BulkWriteError. Returns the operations to retry."""
+        if not isinstance(outcome, BulkWriteError):
+            self._partials.append(self._counts(outcome))
+            return []
+        self._partials.append(outcome.details)
+        # The writes were applied but not acknowledged as requested; retrying could apply them twice
+        self._write_concern_errors.extend(outcome.details.get("writeConcernErrors", []))
+        retry, errors = self._retryable_operations(pending, outcome)
+        self._errors.extend(errors)
+        return retry
+
+    def _backoff(self):
+        return BULK_WRITE_RETRY_BACKOFF * 2 ** (self._attempt - 1)
+
+    def _finish(self, operations, pending):
+        """Summarises the flushed batch. Raises BulkWriteError if any operation failed for good."""
+        self._errors.extend({"code": None, "errmsg": "retries exhausted", "op": str(op)} for op in pending)
+        summary = {
+            "operations": len(operations), "inserted": 0, "matched": 0, "modified": 0, "upserted": 0,
+            "errors": self._errors, "write_concern_errors": self._write_concern_errors
+        }
+        for partial in self._partials:
+            summary["inserted"] += partial.get("nInserted", 0)
+            summary["matched"] += partial.get("nMatched", 0)
+            summary["modified"] += partial.get("nModified", 0)
+            summary["upserted"] += partial.get("nUpserted", 0)
+        self.results.append(summary)
+        if summary["errors"] or summary["write_concern_errors"]:
+            raise BulkWriteError({
+                "writeErrors": summary["errors"],
+                "writeConcernErrors": summary["write_concern_errors"],
+                "batchSummary": summary
+            })
+        return summary
+
+    @staticmethod
+    def _counts(result):
+        return {
+            "nInserted": result.inserted_count,
+            "nMatched": result.matched_count,
+            "nModified": result.modified_count,
+            "nUpserted": result.upserted_count,
+        }
+
+class BulkWriter(BulkWriterBase):
+    """Bulk writer for pymongo collections. Use as a context manager to flush on exit."""
+
+    def add(self, operation):
+        if self._buffer(operation):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Writes all buffered operations. Returns the batch summary, or None if nothing was buffered."""
+        operations = self._take_batch()
+        if not operations:
+            return None
+        pending = operations
+        for self._attempt in range(self.max_retries + 1):
+            if self._attempt:
+                time.sleep(self._backoff())
+            try:
+                outcome = self.collection.bulk_write(pending, ordered=False)
+            except (AutoReconnect, NetworkTimeout):
+                if self._attempt == self.max_retries:
+                    raise
+                continue
+            except BulkWriteError as e:
+                outcome = e
+            pending = self._record(pending, outcome)
+            if not pending:
+                break
+        return self._finish(operations, pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+class AsyncBulkWriter(BulkWriterBase):
+    """Bulk writer for motor collections. Use as an async context manager to flush on exit."""
+
+    async def add(self, operation):
+        if self._buffer(operation):
+            return await self.flush()
+        return None
+
+    async def flush(self):
+        """Writes all buffered operations. Returns the batch summary, or None if nothing was buffered."""
+        operations = self._take_batch()
+        if not operations:
+            return None
+        pending = operations
+        for self._attempt in range(self.max_retries + 1):
+            if self._attempt:
+                await asyncio.sleep(self._backoff())
+            try:
+                outcome = await self.collection.bulk_write(pending, ordered=False)
+            except (AutoReconnect, NetworkTimeout):
+                if self._attempt == self.max_retries:
+                    raise
+                continue
+            except BulkWriteError as e:
+                outcome = e
+            pending = self._record(pending, outcome)
+            if not pending:
+                break
+        return self._finish(operations, pending)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
@@ -1,40 +1,67 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-import numpy as np
+import asyncio
+import os
+from joblib import Parallel, delayed
+from utils.embeddings import generate_embeddings
+from utils.metrics import stage_timer
 
-async def cluster_tickets(tickets, logger, max_clusters=5):
-    logger.info("Ticket clustering Started")
-    descriptions = [ticket["description"] for ticket in tickets]
-    
-    # Load MiniLM model for embeddings
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = model.encode(descriptions, convert_to_numpy=True)
-    
-    # Avoid more clusters than data points
-    max_clusters = min(max_clusters, len(tickets))
-    
-    # Find optimal clusters using silhouette score
-    best_k = 2  # Minimum 2 clusters
-    best_score = -1
-    
-    for k in range(2, max_clusters + 1):
+# Inputs larger than this are clustered with MiniBatchKMeans instead of full KMeans
+MINIBATCH_THRESHOLD = int(os.getenv("CLUSTERING_MINIBATCH_THRESHOLD", "5000"))
+MINIBATCH_SIZE = int(os.getenv("CLUSTERING_MINIBATCH_SIZE", "2048"))
+# Candidate k values are scored on a random sample instead of all pairwise distances
+SILHOUETTE_SAMPLE_SIZE = int(os.getenv("CLUSTERING_SILHOUETTE_SAMPLE_SIZE", "2000"))
+# Candidate k values fitted in parallel; -1 uses every core
+CLUSTERING_N_JOBS = int(os.getenv("CLUSTERING_N_JOBS", "-1"))
+
+def ticket_text(ticket):
+    """Text a ticket is embedded from, shared by clustering, labelling and classification."""
+    return ticket["description"] + " in " + ticket["product"]
+
+def _fit_and_score(embeddings, k):
+    # scikit-learn is only needed once the LLM labelling pipeline runs
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+    if len(embeddings) > MINIBATCH_THRESHOLD:
+        kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=MINIBATCH_SIZE)
+    else:
         kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-        labels = kmeans.fit_predict(embeddings)
-        score = silhouette_score(embeddings, labels)
-        
-        if score > best_score:
-            best_score = score
-            best_k = k
-    
-    # Apply K-Means with the best number of clusters
-    kmeans = KMeans(n_clusters=best_k, random_state=42, n_init=10)
     labels = kmeans.fit_predict(embeddings)
-    
+    score = silhouette_score(
+        embeddings, labels, sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(embeddings)), random_state=42
+    )
+    return score, k, labels
+
+def _best_labels(embeddings, max_clusters):
+    # Silhouette needs 2 <= k <= n - 1
+    max_clusters = min(max_clusters, len(embeddings) - 1)
+    if max_clusters < 2:
+        return [0] * len(embeddings)
+    candidates = range(2, max_clusters + 1)
+    n_jobs = CLUSTERING_N_JOBS if CLUSTERING_N_JOBS > 0 else (os.cpu_count() or 1)
+    # Each candidate k runs in its own process; joblib limits the BLAS/OpenMP threads per process
+    results = Parallel(n_jobs=min(n_jobs, len(candidates)))(
+        delayed(_fit_and_score)(embeddings, k) for k in candidates
+    )
+    # Highest score wins, ties go to the smaller k as in the sequential search
+    _, _, labels = max(results, key=lambda result: (result[0], -result[1]))
+    return labels
+
+async def cluster_tickets(tickets, logger, max_clusters=5):
+    """
+    Groups tickets by embedding similarity, choosing k in [2, max_clusters] by silhouette score.
+    Embeddings come from the shared model and embedding cache.
+    Returns (clusters, embeddings): lists of tickets, and the float32 embedding matrix in input order.
+    """
+    logger.info("Ticket clustering Started")
+    with stage_timer("cluster_tickets", "embedding"):
+        embeddings = await asyncio.to_thread(generate_embeddings, [ticket_text(ticket) for ticket in tickets], as_numpy=True)
+
+    with stage_timer("cluster_tickets", "k_search"):
+        labels = await asyncio.to_thread(_best_labels, embeddings, max_clusters)
+
     # Organize tickets into clusters
-    clusters = {i: [] for i in range(best_k)}
-    for i, label in enumerate(labels):
-        clusters[label].append(tickets[i])
-    
-    logger.info("Ticket clustering done")
-    return list(clusters.values())
+    clusters = {}
+    for ticket, label in zip(tickets, labels):
+        clusters.setdefault(label, []).append(ticket)
+
+    logger.info(f"Ticket clustering done with {len(clusters)} clusters")
+    return list(clusters.values()), embeddings
@@ -1,28 +1,145 @@
+import logging
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from motor.motor_asyncio import AsyncIOMotorClient
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")  
 DB_NAME = os.getenv("DB_NAME", "ticket_classification")  
 
-# Required collections can be passed as a comma-separated list
+# Required collections can be passed as a comma-separated list; ensure_indexes creates them on startup
 REQUIRED_COLLECTIONS = os.getenv("REQUIRED_COLLECTIONS", "").split(",")
 
-# Establish connection
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-db.command("ping")
+# Connection pool limits, shared by the sync and async clients
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+
+# Documents fetched per round-trip by async cursors
+CURSOR_BATCH_SIZE = int(os.getenv("MONGO_CURSOR_BATCH_SIZE", "1000"))
+
+# Blocking client, connected on first use so importing the app doesn't wait on Mongo
+client = None
+
+# Non-blocking client for request handlers and background jobs, created on first use
+async_client = None
+
+def get_client():
+    """Returns the shared pymongo client."""
+    global client
+    if client is None:
+        client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+    return client
 
 def get_db():
-    return db
+    return get_client()[DB_NAME]
+
+def ping():
+    """Raises if MongoDB can't be reached."""
+    get_db().command("ping")
+
+def get_async_db():
+    """Returns the shared motor database handle."""
+    global async_client
+    if async_client is None:
+        async_client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+    return async_client[DB_NAME]
+
+def get_async_collection(collection_name):
+    """Returns a motor collection. Collections are created implicitly on first write."""
+    return get_async_db()[collection_name]
+
+# Collection handles already resolved in this process
+collection_handles = {}
 
 def get_mongo_collection(collection_name):
     """Returns the MongoDB collection. If missing, it is created."""
+    collection = collection_handles.get(collection_name)
+    if collection is not None:
+        return collection
+    db = get_db()
     if collection_name and collection_name not in db.list_collection_names():
-        print(f"⚠️ Collection '{collection_name}' not found. Creating it now...")
+        logging.getLogger("app_logger").warning(f"Collection '{collection_name}' not found. Creating it now...")
         db.create_collection(collection_name)
-    return db[collection_name]
+    collection = db[collection_name]
+    collection_handles[collection_name] = collection
+    return collection
+
+# Indexes required by the hot queries, created idempotently on startup
+REQUIRED_INDEXES = {
+    "jobs": [IndexModel([("job_id", ASCENDING)], unique=True)],
+    "training_jobs": [
+        IndexModel([("job_id", ASCENDING)], unique=True),
+        # At most one queued or running training job
+        IndexModel([("active", ASCENDING)], unique=True, partialFilterExpression={"active": True}),
+    ],
+    "tickets": [
+        # Also serves paging through a job's results in _id order
+        IndexModel([("job_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("ticket_id", ASCENDING)]),
+        IndexModel([("updatedAt", ASCENDING)]),
+    ],
+    "classified_tickets": [IndexModel([("updatedAt", ASCENDING)])],
+    "training_logs": [
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("model_version", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "embeddings_cache": [IndexModel([("hash", ASCENDING)], unique=True)],
+    "llm_response_cache": [IndexModel([("key", ASCENDING)], unique=True)],
+}
+
+# Representative filters and sorts of the queries on request and job paths
+HOT_QUERIES = [
+    ("jobs", {"job_id": ""}, None),
+    ("training_jobs", {"job_id": ""}, None),
+    ("tickets", {"job_id": ""}, None),
+    ("tickets", {"ticket_id": 0}, None),
+    ("tickets", {"updatedAt": {"$gt": ""}}, None),
+    ("classified_tickets", {"updatedAt": {"$gt": ""}}, None),
+    ("training_logs", {}, [("timestamp", DESCENDING)]),
+    ("training_logs", {"model_version": ""}, [("timestamp", DESCENDING)]),
+    ("embeddings_cache", {"hash": {"$in": [""]}}, None),
+    ("llm_response_cache", {"key": ""}, None),
+]
+
+def ensure_indexes(logger=None):
+    """
+    Creates the REQUIRED_COLLECTIONS and all required indexes.
+    Existing collections, and indexes with the same spec, are left untouched.
+    """
+    logger = logger or logging.getLogger("app_logger")
+    for collection_name in REQUIRED_COLLECTIONS:
+        if collection_name.strip():
+            get_mongo_collection(collection_name.strip())
+    for collection_name, indexes in REQUIRED_INDEXES.items():
+        try:
+            names = get_mongo_collection(collection_name).create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate keys left from before a unique index existed; the API still works without it
+            logger.warning(f"Index creation failed on '{collection_name}': {e}")
+            continue
+        logger.info(f"Ensured indexes on {collection_name}: {', '.join(names)}")
+
+def _plan_stages(plan):
+    """Yields every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
 
-# Ensure all required collections exist on startup
-for collection in REQUIRED_COLLECTIONS:
-    if collection.strip():
-        get_mongo_collection(collection.strip())
+def find_collection_scans(logger=None):
+    """Explains each hot query and returns the ones whose winning plan is a COLLSCAN."""
+    collection_scans = []
+    for collection_name, query, sort in HOT_QUERIES:
+        cursor = get_mongo_collection(collection_name).find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning_plan):
+            collection_scans.append({"collection": collection_name, "query": query, "sort": sort})
+            if logger:
+                logger.warning(f"Query on {collection_name} {query} is doing a COLLSCAN")
+    return collection_scans
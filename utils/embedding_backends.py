@@ -0,0 +1,82 @@
+"""
+Backends that run the sentence embedding model, selected with EMBEDDING_BACKEND:
+
+- torch: the PyTorch model in fp32 (default)
+- onnx: the same model exported to ONNX, run by ONNX Runtime in fp32
+- onnx-int8: the ONNX export with weights dynamically quantised to int8 (EMBEDDING_QUANTIZATION
+  picks the target instruction set: arm64, avx2, avx512 or avx512_vnni)
+
+The ONNX backends need `pip install "sentence-transformers[onnx]"`. The int8 model is exported
+once to EMBEDDING_EXPORT_DIR and reused. Every backend returns normalised 384-dim float32 vectors,
+but they differ slightly; run scripts/embedding_parity.py before switching a deployment.
+"""
+import os
+import shutil
+import tempfile
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_EXPORT_DIR = os.getenv("EMBEDDING_EXPORT_DIR", "models/embeddings")
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "avx2")
+
+def cache_namespace(backend):
+    """
+    Prefix of the embedding cache keys of a backend, so vectors of different backends never mix.
+    The torch backend keeps the unprefixed keys already stored in embeddings_cache.
+    """
+    if backend == "torch":
+        return ""
+    if backend == "onnx-int8":
+        return f"onnx-int8-{EMBEDDING_QUANTIZATION}:"
+    return f"{backend}:"
+
+def _session_options(threads):
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    return options
+
+def _export_int8(model_name):
+    """Exports the int8 model unless it already exists. Returns (model dir, ONNX file name in it)."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    export_path = os.path.join(EMBEDDING_EXPORT_DIR, f"{model_name}-onnx-int8-{EMBEDDING_QUANTIZATION}")
+    file_name = f"onnx/model_qint8_{EMBEDDING_QUANTIZATION}.onnx"
+    if os.path.exists(os.path.join(export_path, file_name)):
+        return export_path, file_name
+
+    # Exported next to its final location and renamed into place, so concurrent workers
+    # never load a partial export
+    os.makedirs(EMBEDDING_EXPORT_DIR, exist_ok=True)
+    temp_path = tempfile.mkdtemp(dir=EMBEDDING_EXPORT_DIR, prefix=".export-")
+    try:
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save_pretrained(temp_path)
+        export_dynamic_quantized_onnx_model(model, EMBEDDING_QUANTIZATION, temp_path)
+        try:
+            os.replace(temp_path, export_path)
+        except OSError:
+            if not os.path.exists(os.path.join(export_path, file_name)):
+                raise
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    return export_path, file_name
+
+def load_backend(backend, model_name, threads=0):
+    """
+    Loads `model_name` with the given backend. `threads` caps the intra-op threads of the
+    process (0 keeps the runtime default). The result has SentenceTransformer's encode().
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"session_options": _session_options(threads)})
+    export_path, file_name = _export_int8(model_name)
+    return SentenceTransformer(
+        export_path, backend="onnx", model_kwargs={"file_name": file_name, "session_options": _session_options(threads)}
+    )
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import add_timing, EMBEDDING_BATCH_QUEUE_WAIT, EMBEDDING_BATCH_TEXTS, EMBEDDING_BATCH_REQUESTS
+
+# Merge small encode requests from concurrent callers into one model call
+EMBEDDING_MICROBATCH = os.getenv("EMBEDDING_MICROBATCH", "true").lower() == "true"
+# A batch starts this long after its first request at the latest
+EMBEDDING_MICROBATCH_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_WAIT_MS", "5"))
+# ...or as soon as it holds this many texts. Larger requests are already big batches: blocking
+# callers encode them directly, and job chunks queue for the model without waiting for others
+EMBEDDING_MICROBATCH_MAX_TEXTS = int(os.getenv("EMBEDDING_MICROBATCH_MAX_TEXTS", "256"))
+
+class EmbeddingBatcher:
+    """
+    Collects encode requests from every caller in the process for up to max_wait_ms or
+    max_texts texts, encodes them with one `encode` call in a worker thread and resolves
+    each caller with its own rows. Runs on the event loop it is started on; threads submit
+    through embed_from_thread. Until started, callers encode on their own.
+    Encodes run on the batcher's own thread, so they never wait for a default executor thread
+    held by a blocking caller that is itself waiting on the batch.
+    """
+
+    def __init__(self, encode, max_wait_ms=EMBEDDING_MICROBATCH_WAIT_MS, max_texts=EMBEDDING_MICROBATCH_MAX_TEXTS):
+        # encode(texts, timings) returns a float32 matrix with a row per text
+        self.encode = encode
+        self.max_wait = max_wait_ms / 1000
+        self.max_texts = max_texts
+        self.loop = None
+        self.loop_thread = None
+        self.queue = None
+        self.task = None
+        self.executor = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-batcher")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        task, self.task = self.task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            future.cancel()
+        self.executor.shutdown(wait=False)
+        self.executor = None
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    def batches(self, count):
+        """Whether a request of `count` texts should go through the batcher; large ones gain nothing from waiting."""
+        return self.running and 0 < count < self.max_texts
+
+    def accepts(self, count):
+        """batches() for blocking callers, which can't wait on the loop from the loop thread itself."""
+        return self.batches(count) and threading.get_ident() != self.loop_thread
+
+    async def embed(self, texts, timings=None):
+        """Returns the float32 embeddings of `texts` once the batch they joined is encoded."""
+        future = self.loop.create_future()
+        self.queue.put_nowait((texts, future, time.perf_counter()))
+        vectors, queue_wait, batch_timings = await future
+        add_timing(timings, "queue_wait", queue_wait)
+        for stage, seconds in batch_timings.items():
+            add_timing(timings, stage, seconds)
+        return vectors
+
+    def embed_from_thread(self, texts, timings=None):
+        """Blocking embed() for callers running in other threads."""
+        return asyncio.run_coroutine_threadsafe(self.embed(texts, timings), self.loop).result()
+
+    async def _run(self):
+        requests = []
+        try:
+            while True:
+                requests = [await self.queue.get()]
+                count = len(requests[0][0])
+                deadline = self.loop.time() + self.max_wait
+                while count < self.max_texts:
+                    timeout = deadline - self.loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    requests.append(request)
+                    count += len(request[0])
+                # The next batch fills up while this one is encoded
+                await self._encode_batch(requests)
+        except asyncio.CancelledError:
+            # Stopped: don't leave the callers of the current batch waiting
+            for _, future, _ in requests:
+                future.cancel()
+            raise
+
+    async def _encode_batch(self, requests):
+        started = time.perf_counter()
+        texts = [text for request_texts, _, _ in requests for text in request_texts]
+        EMBEDDING_BATCH_TEXTS.observe(len(texts))
+        EMBEDDING_BATCH_REQUESTS.observe(len(requests))
+        for _, _, enqueued in requests:
+            EMBEDDING_BATCH_QUEUE_WAIT.observe(started - enqueued)
+
+        timings = {}
+        try:
+            vectors = await self.loop.run_in_executor(self.executor, self.encode, texts, timings)
+        except Exception as e:
+            for _, future, _ in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for request_texts, future, enqueued in requests:
+            # Callers may have given up waiting
+            if not future.done():
+                future.set_result((vectors[offset:offset + len(request_texts)], started - enqueued, timings))
+            offset += len(request_texts)
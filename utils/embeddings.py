@@ -1,32 +1,167 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from pymongo.errors import BulkWriteError
 from services.database import get_mongo_collection
+from utils.lru_cache import LRUCache
+from utils.vector_codec import encode_vector, decode_vector
+from utils.metrics import stage_timer, EMBEDDING_CACHE_LOOKUPS
+from utils.embedding_backends import cache_namespace, load_backend
+from utils.embedding_batcher import EmbeddingBatcher
 import hashlib
+import logging
+import os
+import threading
 
-# Load a local transformer model
-model = SentenceTransformer("all-MiniLM-L6-v2")  # Small & fast model
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"  # Small & fast model
+EMBEDDING_DIM = 384
+# torch, onnx or onnx-int8, see utils/embedding_backends.py
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Intra-op threads used for encoding in this process; 0 keeps the runtime default
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
 
-def generate_embedding(text):
-    
-    try:
-        collection = get_mongo_collection("embeddings_cache")
+# Local transformer model, loaded on first use (or by warm-up) since importing torch is slow
+model = None
+_model_lock = threading.Lock()
+_default_threads = 0
+
+# Number of texts handed to the transformer per forward pass
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# In-process tier in front of the embeddings_cache collection, keyed by text hash
+embedding_lru = LRUCache(int(os.getenv("EMBEDDING_LRU_SIZE", "20000")))
+mongo_cache_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def set_default_threads(threads):
+    """Intra-op threads used when EMBEDDING_THREADS isn't set, e.g. a share of the cores per worker process."""
+    global _default_threads
+    _default_threads = threads
+
+def get_embedding_model():
+    """Returns the shared model of the configured backend, loading it on first call."""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = load_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, EMBEDDING_THREADS or _default_threads)
+    return model
+
+def get_embedding_cache_stats():
+    """Hit/miss counters for both cache tiers."""
+    with _stats_lock:
+        mongo_stats = dict(mongo_cache_stats)
+    return {"lru": embedding_lru.stats(), "mongo": mongo_stats}
+
+def hash_text(text, backend=EMBEDDING_BACKEND):
+    """Returns the cache key used for a text in embeddings_cache. Keys are distinct per backend."""
+    return hashlib.sha256((cache_namespace(backend) + text).encode()).hexdigest()
 
-        # Hash the text for caching
-        text_hash = hashlib.sha256(text.encode()).hexdigest()
-        cached_embedding = collection.find_one({"hash": text_hash})
+def generate_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, as_numpy=False, timings=None):
+    """
+    Generate embeddings for a batch of texts.
+    While the micro-batcher runs, small requests from threads are merged with other callers'
+    into one encode; everything else is encoded directly.
+    Returns a list of float lists, or a float32 matrix when `as_numpy` is set.
+    """
+    if embedding_batcher.accepts(len(texts)):
+        vectors = embedding_batcher.embed_from_thread(texts, timings)
+        return vectors if as_numpy else vectors.tolist()
+    return encode_texts(texts, batch_size, as_numpy, timings)
 
-        if cached_embedding:
-            return cached_embedding["embedding"]
+def encode_texts(texts, batch_size=EMBEDDING_BATCH_SIZE, as_numpy=False, timings=None):
+    """
+    Embeds texts in the calling thread.
+    Vectors are looked up in the in-process LRU first, then in the embeddings_cache
+    collection with a single query. Only the misses are encoded, and the new vectors
+    are written to both tiers (one bulk insert for Mongo).
+    Stage durations are added to `timings` when given.
+    Returns a list of float lists, or a float32 matrix when `as_numpy` is set.
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32) if as_numpy else []
+    hashes = [hash_text(text) for text in texts]
+    embeddings = {}
 
-        # Generate the embedding
-        embedding = model.encode(text).tolist()
+    with stage_timer("embedding", "cache_lookup", timings):
+        # First tier: in-process LRU
+        lookup_hashes = []
+        for text_hash in set(hashes):
+            vector = embedding_lru.get(text_hash)
+            if vector is not None:
+                embeddings[text_hash] = vector
+            else:
+                lookup_hashes.append(text_hash)
+        EMBEDDING_CACHE_LOOKUPS.labels("lru", "hit").inc(len(embeddings))
+        EMBEDDING_CACHE_LOOKUPS.labels("lru", "miss").inc(len(lookup_hashes))
+
+        # Second tier: Mongo, one query for everything the LRU didn't have.
+        # Mongo hits are promoted into the LRU.
+        collection = None
+        if lookup_hashes:
+            try:
+                collection = get_mongo_collection("embeddings_cache")
+                cursor = collection.find(
+                    {"hash": {"$in": lookup_hashes}},
+                    {"_id": 0, "hash": 1, "embedding": 1}
+                )
+                mongo_hits = 0
+                for doc in cursor:
+                    vector = decode_vector(doc["embedding"])
+                    embeddings[doc["hash"]] = vector
+                    embedding_lru.put(doc["hash"], vector)
+                    mongo_hits += 1
+                with _stats_lock:
+                    mongo_cache_stats["hits"] += mongo_hits
+                    mongo_cache_stats["misses"] += len(lookup_hashes) - mongo_hits
+                EMBEDDING_CACHE_LOOKUPS.labels("mongo", "hit").inc(mongo_hits)
+                EMBEDDING_CACHE_LOOKUPS.labels("mongo", "miss").inc(len(lookup_hashes) - mongo_hits)
+            except Exception as e:
+                logging.getLogger("app_logger").warning(f"Embedding cache lookup failed: {e}")
+                collection = None
+
+    # Encode each distinct missing text once
+    missing = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash not in embeddings and text_hash not in missing:
+            missing[text_hash] = text
+
+    if missing:
+        embedding_model = get_embedding_model()
+        with stage_timer("embedding", "encode", timings):
+            try:
+                vectors = embedding_model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True)
+            except Exception as e:
+                logging.getLogger("app_logger").error(f"Embedding generation failed: {e}")
+                vectors = None
+
+        new_documents = []
+        for i, text_hash in enumerate(missing.keys()):
+            # Returns zero vector (model size: 384) when the model failed
+            vector = vectors[i].astype(np.float32) if vectors is not None else np.zeros(EMBEDDING_DIM, dtype=np.float32)
+            embeddings[text_hash] = vector
+            if vectors is not None:
+                embedding_lru.put(text_hash, vector)
+                new_documents.append({"hash": text_hash, "embedding": encode_vector(vector)})
 
         # Store in DB cache
-        collection.insert_one({"hash": text_hash, "embedding": embedding})
+        if collection is not None and new_documents:
+            with stage_timer("embedding", "cache_write", timings):
+                try:
+                    collection.insert_many(new_documents, ordered=False)
+                except BulkWriteError:
+                    pass  # Another writer cached some of these texts concurrently
+                except Exception as e:
+                    logging.getLogger("app_logger").warning(f"Embedding cache write failed: {e}")
+
+    if as_numpy:
+        return np.stack([embeddings[text_hash] for text_hash in hashes])
+    return [embeddings[text_hash].tolist() for text_hash in hashes]
 
-        return embedding
+def _encode_batch(texts, timings):
+    return encode_texts(texts, as_numpy=True, timings=timings)
 
-    except Exception as e:
-        print(f"Embedding generation failed: {e}")
-        return np.zeros(384).tolist()  # Returns zero vector (model size: 384)
+# Started on the API event loop; worker processes never start it and encode directly
+embedding_batcher = EmbeddingBatcher(_encode_batch)
 
+def generate_embedding(text):
+    """Generate the embedding for a single text."""
+    return generate_embeddings([text])[0]
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import os
+import random
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+from utils.connection import get_async_collection
+from utils.lru_cache import LRUCache
+from utils.metrics import LLM_CALLS, LLM_CACHE_HITS, LLM_CALL_SECONDS
+
+# Load config
+api_key = os.getenv("API_KEY", "")
+# Point at scripts/llm_stub_server.py (e.g. http://localhost:8001/v1) to run offline
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "1.0"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Responses are cached in-process and in Mongo, keyed by prompt and metadata version
+response_lru = LRUCache(int(os.getenv("LLM_RESPONSE_LRU_SIZE", "2000")))
+llm_call_stats = {"calls": 0, "retries": 0, "cache_hits": 0}
+
+# The openai SDK is imported with the client, on the first LLM call
+client = None
+semaphore = None
+retryable_errors = ()
+
+def get_llm_client():
+    """Returns the shared async OpenAI client. Retries are handled here, not by the SDK."""
+    global client, semaphore, retryable_errors
+    if client is None:
+        from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        retryable_errors = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+        client = AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, timeout=LLM_TIMEOUT, max_retries=0)
+        semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    return client
+
+def response_cache_key(prompt, cache_version):
+    return hashlib.sha256(f"{cache_version}:{LLM_MODEL}:{prompt}".encode()).hexdigest()
+
+async def _create_completion(prompt):
+    llm_client = get_llm_client()
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with semaphore:
+                llm_call_stats["calls"] += 1
+                with LLM_CALL_SECONDS.time():
+                    response = await llm_client.chat.completions.create(
+                        messages=[{"role": "user", "content": prompt}],
+                        model=LLM_MODEL
+                    )
+            LLM_CALLS.labels("success").inc()
+            return response.choices[0].message.content
+        except retryable_errors:
+            if attempt == LLM_MAX_RETRIES:
+                LLM_CALLS.labels("error").inc()
+                raise
+            LLM_CALLS.labels("retry").inc()
+            llm_call_stats["retries"] += 1
+            # Exponential backoff with jitter so concurrent callers don't retry in lockstep
+            await asyncio.sleep(LLM_RETRY_BACKOFF * 2 ** attempt * (0.5 + random.random()))
+
+async def complete(prompt, cache_version, parse=lambda content: content, use_cache=True):
+    """
+    Returns the model's reply to a single-message prompt, passed through `parse`.
+    `cache_version` identifies everything besides the prompt that the reply depends on
+    (e.g. the metadata version), so changing it invalidates cached replies.
+    Replies that fail to parse are never cached.
+    """
+    if not use_cache:
+        return parse(await _create_completion(prompt))
+
+    key = response_cache_key(prompt, cache_version)
+    content = response_lru.get(key)
+    if content is not None:
+        llm_call_stats["cache_hits"] += 1
+        LLM_CACHE_HITS.labels("lru").inc()
+        return parse(content)
+
+    collection = get_async_collection("llm_response_cache")
+    cached = await collection.find_one({"key": key}, {"content": 1})
+    if cached:
+        llm_call_stats["cache_hits"] += 1
+        LLM_CACHE_HITS.labels("mongo").inc()
+        response_lru.put(key, cached["content"])
+        return parse(cached["content"])
+
+    content = await _create_completion(prompt)
+    parsed = parse(content)
+    response_lru.put(key, content)
+    try:
+        await collection.insert_one({
+            "key": key,
+            "model": LLM_MODEL,
+            "cache_version": cache_version,
+            "content": content,
+            "createdAt": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        pass  # A concurrent caller cached the same prompt
+    return parsed
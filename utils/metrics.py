@@ -0,0 +1,108 @@
+"""
+Prometheus metrics for the hot paths, rendered in text format by the /metrics endpoint.
+
+Metrics are recorded by the process doing the work. Embedding and inference for classification
+jobs run in job scheduler workers and training runs in its own process, so set
+PROMETHEUS_MULTIPROC_DIR to an empty directory before starting the server to aggregate every
+process (including all uvicorn workers). Without it, /metrics only shows the serving process;
+the per-job breakdown on the jobs document is complete either way.
+"""
+import asyncio
+import functools
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, REGISTRY
+)
+
+# Stage durations range from sub-millisecond cache lookups to multi-minute training runs
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each stage of a pipeline",
+    ["pipeline", "stage"], buckets=STAGE_BUCKETS
+)
+DB_OPERATION_SECONDS = Histogram(
+    "db_operation_duration_seconds", "Time spent in database layer calls",
+    ["operation"], buckets=STAGE_BUCKETS
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    "embedding_cache_lookups_total", "Embedding cache lookups by tier and result",
+    ["tier", "result"]
+)
+EMBEDDING_BATCH_QUEUE_WAIT = Histogram(
+    "embedding_batch_queue_wait_seconds", "Time encode requests wait for their micro-batch to start",
+    buckets=STAGE_BUCKETS
+)
+EMBEDDING_BATCH_TEXTS = Histogram(
+    "embedding_batch_texts", "Texts encoded per micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+EMBEDDING_BATCH_REQUESTS = Histogram(
+    "embedding_batch_requests", "Encode requests merged into each micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+LLM_CALLS = Counter(
+    "llm_calls_total", "Chat completion requests sent to the LLM by outcome",
+    ["outcome"]
+)
+LLM_CACHE_HITS = Counter(
+    "llm_cache_hits_total", "LLM replies served from the response cache by tier",
+    ["tier"]
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds", "Latency of chat completion requests", buckets=STAGE_BUCKETS
+)
+TICKETS_CLASSIFIED = Counter(
+    "tickets_classified_total", "Tickets classified by mode of tagging",
+    ["mode"]
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "classification_job_queue_depth", "Classification jobs waiting in the scheduler queue",
+    multiprocess_mode="livesum"
+)
+RUNNING_JOBS = Gauge(
+    "classification_jobs_running", "Classification jobs being classified",
+    multiprocess_mode="livesum"
+)
+
+def add_timing(timings, stage, seconds):
+    """Accumulates a stage's seconds into a per-job timings dict, if one is being collected."""
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def stage_timer(pipeline, stage, timings=None):
+    """Observes the duration of the enclosed block and adds it to `timings` when given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.labels(pipeline, stage).observe(seconds)
+        add_timing(timings, stage, seconds)
+
+def timed_db_operation(function):
+    """Decorates a sync or async database layer function to record its duration."""
+    histogram = DB_OPERATION_SECONDS.labels(function.__name__)
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            with histogram.time():
+                return await function(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return function(*args, **kwargs)
+    return wrapper
+
+def render_metrics():
+    """Returns (body, content type) of every metric in Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
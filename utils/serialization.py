@@ -0,0 +1,33 @@
+import base64
+import binascii
+import numpy as np
+import orjson
+from bson import ObjectId
+from bson.binary import Binary
+
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _default(value):
+    """Handles the types orjson doesn't serialize natively (datetimes and numpy arrays are native)."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Binary):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(value):
+    """Serializes Mongo documents straight to JSON bytes, without copying them first."""
+    return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+def encode_cursor(object_id):
+    """Opaque pagination token for a document _id."""
+    return base64.urlsafe_b64encode(ObjectId(object_id).binary).decode().rstrip("=")
+
+def decode_cursor(token):
+    """Returns the _id a pagination token points after. Raises ValueError for malformed tokens."""
+    try:
+        return ObjectId(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Invalid pagination token") from e
@@ -0,0 +1,233 @@
+import codecs
+import json
+import os
+import tempfile
+import aiofiles
+from utils.validateFile import isAllColumnsPresent
+
+# Uploads are spooled here so they can be parsed incrementally after the request returns
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+READ_CHUNK_SIZE = 64 * 1024
+# Largest record (in characters) the parser buffers while looking for its end. Malformed
+# JSON is reported once this much is buffered instead of after reading the rest of the file
+MAX_RECORD_SIZE = int(os.getenv("UPLOAD_MAX_RECORD_SIZE", str(1024 * 1024)))
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+class TicketStreamError(ValueError):
+    """Raised when an upload isn't valid `{"tickets": [...]}` JSON or NDJSON."""
+
+class _Buffer:
+    """Text buffer over an iterator of byte chunks, refilled on demand."""
+
+    def __init__(self, chunks, max_record_size=MAX_RECORD_SIZE):
+        self.chunks = iter(chunks)
+        self.max_record_size = max_record_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        # Position that must survive compaction while looking ahead
+        self.mark = None
+        self.eof = False
+
+    def fill(self):
+        """Reads another chunk. Returns False once the input is exhausted."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        # Drop consumed text so the buffer only holds the record being parsed
+        start = self.pos if self.mark is None else min(self.mark, self.pos)
+        self.text = self.text[start:]
+        self.pos -= start
+        if self.mark is not None:
+            self.mark -= start
+        if len(self.text) > self.max_record_size:
+            raise TicketStreamError(f"Malformed JSON, or a record larger than {self.max_record_size} characters")
+        if chunk is None:
+            self.eof = True
+            self.text += self.decoder.decode(b"", final=True)
+        else:
+            self.text += self.decoder.decode(chunk)
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it, or None at EOF."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise TicketStreamError(f"Expected one of {characters!r} but found {character!r}")
+        self.pos += 1
+        return character
+
+    def decode_value(self):
+        """Decodes the next complete JSON value, reading more input until it is available."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError as e:
+                if not self.fill():
+                    raise TicketStreamError(f"Malformed JSON: {e}") from e
+                continue
+            # A number or literal cut by a chunk boundary parses as a shorter value,
+            # so it only counts as complete once a delimiter follows it
+            if not self.eof and not isinstance(value, (dict, list, str)) and (
+                end == len(self.text) or self.text[end] not in _DELIMITERS
+            ):
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def read_line(self):
+        """Returns the next line without its terminator, or None at EOF."""
+        while True:
+            newline = self.text.find("\n", self.pos)
+            if newline != -1:
+                line = self.text[self.pos:newline]
+                self.pos = newline + 1
+                return line
+            if not self.fill():
+                if self.pos < len(self.text):
+                    line = self.text[self.pos:]
+                    self.pos = len(self.text)
+                    return line
+                return None
+
+def _iter_wrapped_tickets(buffer):
+    """Yields the elements of the "tickets" array of a `{"tickets": [...]}` document."""
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+    while True:
+        key = buffer.decode_value()
+        buffer.expect(":")
+        if key == "tickets":
+            buffer.expect("[")
+            if buffer.peek() == "]":
+                buffer.pos += 1
+            else:
+                while True:
+                    yield buffer.decode_value()
+                    if buffer.expect(",]") == "]":
+                        break
+        else:
+            buffer.decode_value()
+        if buffer.expect(",}") == "}":
+            return
+
+def _iter_ndjson_tickets(buffer):
+    """Yields one ticket per non-empty line."""
+    line_number = 0
+    while True:
+        line = buffer.read_line()
+        if line is None:
+            return
+        line_number += 1
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise TicketStreamError(f"Malformed JSON on line {line_number}: {e}") from e
+
+def _is_wrapped_document(buffer):
+    """
+    Distinguishes `{"tickets": [...]}` from NDJSON by scanning the keys of the first object
+    for a "tickets" array. The scan stops at that array, so it never reads the tickets themselves.
+    """
+    if buffer.peek() != "{":
+        return False
+    buffer.mark = buffer.pos
+    buffer.pos += 1
+    wrapped = False
+    if buffer.peek() == "}":
+        # A lone {} has no tickets, like {"tickets": []}; followed by more lines it is NDJSON
+        buffer.pos += 1
+        wrapped = buffer.peek() is None
+    else:
+        while True:
+            key = buffer.decode_value()
+            buffer.expect(":")
+            if key == "tickets" and buffer.peek() == "[":
+                wrapped = True
+                break
+            buffer.decode_value()
+            if buffer.expect(",}") == "}":
+                break
+    buffer.pos, buffer.mark = buffer.mark, None
+    return wrapped
+
+def iter_tickets(chunks):
+    """
+    Incrementally parses tickets from an iterator of byte chunks.
+    Accepts the `{"tickets": [...]}` upload format and NDJSON (one ticket object per line).
+    """
+    buffer = _Buffer(chunks)
+    if buffer.peek() is None:
+        return iter(())
+    if _is_wrapped_document(buffer):
+        return _iter_wrapped_tickets(buffer)
+    return _iter_ndjson_tickets(buffer)
+
+def iter_file_chunks(path, chunk_size=READ_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def iter_ticket_chunks(tickets, chunk_size):
+    """Groups an iterator of tickets into lists of at most `chunk_size`."""
+    chunk = []
+    for ticket in tickets:
+        chunk.append(ticket)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def spool_upload(chunks):
+    """Writes an async iterator of byte chunks to a file in UPLOAD_DIR and returns its path."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".upload")
+    os.close(fd)
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in chunks:
+                await f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+async def iter_upload_chunks(file, chunk_size=READ_CHUNK_SIZE):
+    """Reads an UploadFile in fixed-size chunks."""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def scan_upload(path):
+    """
+    Validates every ticket of a spooled upload without holding them in memory.
+    Returns (number of tickets, position of the first invalid ticket or None).
+    """
+    count = 0
+    for ticket in iter_tickets(iter_file_chunks(path)):
+        if not isinstance(ticket, dict) or isAllColumnsPresent([ticket])==False:
+            return count, count
+        count += 1
+    return count, None
@@ -2,6 +2,15 @@ def isValidJSONFile(file):
     if not file.filename.endswith(".json") or file.content_type != "application/json":
         return False
     return True
+
+def isValidNDJSONFile(file):
+    if not file.filename.endswith((".ndjson", ".jsonl")):
+        return False
+    return True
+
+def isStreamContentType(content_type):
+    STREAM_CONTENT_TYPES = {"application/json", "application/x-ndjson", "application/jsonl"}
+    return content_type.split(";")[0].strip() in STREAM_CONTENT_TYPES
     
 def isAllColumnsPresent(tickets):
     REQUIRED_FIELDS = {"description", "product"}
@@ -0,0 +1,29 @@
+from bson.binary import Binary
+import numpy as np
+import os
+
+# Storage precision for new vectors: "float32" (default) or "float16"
+VECTOR_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", "float32")
+
+# User-defined BSON binary subtypes identify the element type of a packed vector
+BINARY_SUBTYPES = {"float32": 0x80, "float16": 0x81}
+SUBTYPE_DTYPES = {subtype: np.dtype(dtype) for dtype, subtype in BINARY_SUBTYPES.items()}
+
+def encode_vector(vector, dtype=VECTOR_STORAGE_DTYPE):
+    """Packs a vector into a compact BSON binary blob."""
+    data = np.ascontiguousarray(vector, dtype=dtype).tobytes()
+    return Binary(data, BINARY_SUBTYPES[dtype])
+
+def decode_vector(value):
+    """
+    Returns a stored vector as a float32 numpy array.
+    Accepts both packed binary blobs and legacy BSON arrays, so readers work during migration.
+    float32 blobs are decoded without copying.
+    """
+    if isinstance(value, Binary) and value.subtype in SUBTYPE_DTYPES:
+        vector = np.frombuffer(value, dtype=SUBTYPE_DTYPES[value.subtype])
+        return vector if vector.dtype == np.float32 else vector.astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+def is_encoded_vector(value):
+    return isinstance(value, Binary) and value.subtype in SUBTYPE_DTYPES